@@ -40,7 +40,7 @@ class NodeTest(mt.Node):
         self.nm = nm
 
     def recv(self, ba, caller):
-        self.ba = ba[:]
+        self.ba = bytearray(ba)
         bh = mt.hdump(ba)
         print("NAME:", self.nm)
         print(bh.decode('utf-8'))
@@ -0,0 +1,503 @@
+#! /usr/bin/python3
+
+"""
+Benchmarks for the Nodes, run without GUI and without serial lines.
+
+Synthetic data (the same for each run, see --seed) is fed in chunks through some typical
+graphs of Nodes.  For each case the throughput (bytes/s, calls/s), the time per call
+(percentiles) and the allocations (peak of tracemalloc, collections of the garbage
+collector) are reported and saved in a JSON file, --compare shows the change against the
+results of an earlier run.  --startup measures the time to start a script instead, cold
+(without the caches of compiled code) and warm, and shows the slowest imports.
+
+    python3 bench.py -o before.json
+    python3 bench.py -o after.json --compare before.json
+    python3 bench.py --startup
+"""
+
+import os
+import gc
+import sys
+import json
+import time
+import random
+import argparse
+import platform
+import tempfile
+import statistics
+import subprocess
+import tracemalloc
+
+import mtcore as mt
+
+
+class NullOut(object):
+    """A binary file that forgets what is written to it.
+    """
+    def write(self, ba):
+        return len(ba)
+
+    def flush(self):
+        pass
+
+
+class CountOut(NullOut):
+    """A NullOut that counts the bytes written to it.
+    """
+    def __init__(self):
+        self.n = 0
+
+    def write(self, ba):
+        self.n += len(ba)
+        return len(ba)
+
+
+class Source(mt.Node):
+    """Hands the chunks of a buffer to its receivers, as a NodeSerial would.
+    """
+    def feed(self, mv, chunk):
+        for i in range(0, len(mv), chunk):
+            self.emit(mv[i:i+chunk])
+
+
+def data_text(rnd, n):
+    """Lines of printable text of random length, with CR LF.
+    """
+    words = [bytes(rnd.choice(b'abcdefghijklmnopqrstuvwxyz') for i in range(rnd.randint(1, 9)))
+             for k in range(200)]
+    out = bytearray()
+    while len(out) < n:
+        out += b' '.join(rnd.choice(words) for i in range(rnd.randint(1, 12))) + b'\r\n'
+    return bytes(out[:n])
+
+
+def data_bin(rnd, n):
+    return rnd.randbytes(n)
+
+
+def patterns(rnd, count):
+    """'count' different byte sequences that do not overlap each other.
+    """
+    ret = []
+    for i in range(count):
+        ret.append(b'\x1b[%c%c' % (65 + i % 26, 97 + i // 26))
+    return ret
+
+
+# each case returns (app, source node, data, function to call when all data was fed)
+def case_seqcheck(rnd, n, count):
+    app = mt.MTHeadless(out = NullOut())
+    src = Source(app, 'src')
+    hits = []
+    lobs = [mt.ByteSeq(lambda app, dta, b: hits.append(dta), p, i, False)
+            for i, p in enumerate(patterns(rnd, count))]
+    seq = app.nodeSeqCheck(lobs)
+    src.append_receiver(seq)
+    seq.append_receiver(app.nodeText(None))
+    data = bytearray(data_text(rnd, n))
+    # the sequences neither overlap nor touch each other, so each of them is found
+    slots = range(0, len(data) - 8, 8)
+    each = min(20, len(slots) // count)
+    slots = iter(rnd.sample(slots, each * count))
+    for p in patterns(rnd, count):
+        for k in range(each):
+            i = next(slots)
+            data[i:i+len(p)] = p
+    data = bytes(data)
+    want = each * count
+    def done():
+        assert len(hits) == want, "seqcheck: %i of %i sequences found" % (len(hits), want)
+    return app, src, data, done
+
+
+def case_xfer(rnd, n, size):
+    app = mt.MTHeadless(out = NullOut())
+    src = Source(app, 'src')
+    xo = app.nodeXferOut()
+    xi = app.nodeXferIn()
+    got = [0]
+    xi.add_packet_receiver(app.nodeFunc(lambda ba, c: got.__setitem__(0, got[0] + len(ba))))
+    src.append_receiver(xo)
+    xo.append_receiver(xi)
+    data = data_bin(rnd, n)
+    def done():
+        assert got[0] == len(data), "xfer: %i of %i bytes received" % (got[0], len(data))
+    return app, src, data, done
+
+
+def case_hex(rnd, n, bpl):
+    app = mt.MTHeadless(out = NullOut())
+    src = Source(app, 'src')
+    hx = app.nodeHex(bpl = bpl, offset = bpl != 0)
+    src.append_receiver(hx)
+    hx.append_receiver(app.nodeText(None))
+    return app, src, data_bin(rnd, n), None
+
+
+def case_linebuffer(rnd, n, arg):
+    app = mt.MTHeadless(out = NullOut())
+    src = Source(app, 'src')
+    lb = app.nodeLinebuffer(term = b'\r\n')
+    src.append_receiver(lb)
+    lb.append_receiver(app.nodeText(None))
+    return app, src, data_text(rnd, n), None
+
+
+def case_logfile(rnd, n, fmt):
+    app = mt.MTHeadless(out = NullOut())
+    src = Source(app, 'my port')    # a UID with a space, it must not break the 'text' records
+    fd, fname = tempfile.mkstemp(prefix = 'mtbench')
+    os.close(fd)
+    log = app.nodeLogfile(fname, fmt = fmt)
+    src.append_receiver(log)
+    data = data_text(rnd, n)
+    def done():
+        log.close()
+        if fmt == 'text':
+            # the data must come back from the file unchanged
+            rep = mt.NodeReplay(app, fname)
+            got = bytearray()
+            rep.append_receiver(app.nodeFunc(lambda ba, c: got.extend(ba)))
+            rep.play()
+            rep.close()
+            assert rep.fmt == 'text' and got == data, "the replayed 'text' log differs"
+        os.unlink(fname)
+    return app, src, data, done
+
+
+def case_passthrough(rnd, n, arg):
+    # serial -> log file and text panel
+    app = mt.MTHeadless(out = NullOut())
+    src = Source(app, 'src')
+    fd, fname = tempfile.mkstemp(prefix = 'mtbench')
+    os.close(fd)
+    log = app.nodeLogfile(fname)
+    src.append_receiver(log, app.nodeText(None))
+    def done():
+        log.close()
+        os.unlink(fname)
+    return app, src, data_text(rnd, n), done
+
+
+def case_chain(rnd, n, arg):
+    # serial -> seqcheck -> hex -> select -> ... -> text, 'arg' is (depth, compiled)
+    depth, compiled = arg
+    app = mt.MTHeadless(out = NullOut())
+    src = Source(app, 'src')
+    seq = app.nodeSeqCheck([mt.ByteSeq(lambda app, dta, b: None, b'\x1b[Aa', 0, False)])
+    src.append_receiver(seq)
+    nd = app.nodeHex(uid = 'hex')
+    seq.append_receiver(nd)
+    for i in range(depth):
+        sel = app.nodeSelect('sel%i' % (i))
+        nd.append_receiver(sel)
+        nd = sel
+    nd.append_receiver(app.nodeText(None))
+    if compiled:
+        app.compile()
+    return app, src, data_text(rnd, n), None
+
+
+def case_route(rnd, n, fusable):
+    # serial -> seqcheck -> select -> two text panels, each match switches the route
+    app = mt.MTHeadless(out = NullOut())
+    src = Source(app, 'src')
+    sel = app.nodeSelect('sel', fusable)
+    outs = [app.nodeText(None), app.nodeText(None)]
+    def switch(app, dta, b):
+        sel.route('seq', outs[dta])
+    lobs = [mt.ByteSeq(switch, b'\x1b[%ia' % (i), i, False) for i in range(2)]
+    seq = app.nodeSeqCheck(lobs, 'seq')
+    src.append_receiver(seq)
+    seq.append_receiver(sel)
+    sel.append_receiver(*outs)
+    app.compile()
+    data = bytearray(data_text(rnd, n))
+    for i in range(0, len(data) - 8, 64):
+        data[i:i+5] = b'\x1b[%ia' % (rnd.randrange(2))
+    return app, src, bytes(data), None
+
+
+def case_compiled(rnd, n, arg):
+    # serial -> linebuffer -> stdout and serial -> xfer link -> stdout, with the 'plain'
+    # data of the link, compiled: Nodes with attributes of their own in a compiled graph
+    app = mt.MTHeadless(out = NullOut())
+    src = Source(app, 'src')
+    lines = CountOut()
+    packets = CountOut()
+    plain = CountOut()
+    lb = app.nodeLinebuffer(term = b'\r\n')
+    src.append_receiver(lb)
+    lb.append_receiver(app.nodeStdout(out = lines))
+    link = app.nodeXferLink()
+    link.append_receiver(app.nodeStdout(out = packets))
+    src.append_receiver(link, link.wire)
+    app.compile()
+    link.append_receiver('plain', app.nodeStdout(out = plain))  # compiled again
+    data = data_text(rnd, n)
+    def done():
+        assert lines.n == data.rfind(b'\r\n') + 2, "linebuffer: %i bytes" % (lines.n)
+        assert plain.n == len(data), "link: %i of %i plain bytes" % (plain.n, len(data))
+        assert packets.n > 0 and link.stats['sent'] == link.window, "link: %r" % (link.stats)
+    return app, src, data, done
+
+
+def cases():
+    """Return the list of (name, function, argument, chunk sizes).
+    """
+    ret = []
+    for count in (1, 8, 64):
+        ret.append(('seqcheck-%i' % (count), case_seqcheck, count, (1, 16, 256, 4096)))
+    for size in (16, 256, 4096):
+        ret.append(('xfer-%i' % (size), case_xfer, size, (size,)))
+    for bpl in (0, 16):
+        ret.append(('hex-%i' % (bpl), case_hex, bpl, (16, 4096)))
+    ret.append(('linebuffer', case_linebuffer, None, (1, 16, 256, 4096)))
+    for fmt in ('raw', 'text', 'bin'):
+        ret.append(('logfile-%s' % (fmt), case_logfile, fmt, (16, 4096)))
+    ret.append(('passthrough', case_passthrough, None, (16, 4096)))
+    for depth in (1, 8):
+        ret.append(('chain-%i' % (depth), case_chain, (depth, False), (16, 4096)))
+        ret.append(('chain-%i-compiled' % (depth), case_chain, (depth, True), (16, 4096)))
+    for fusable in (False, True):
+        ret.append(('route%s' % ('-fusable' if fusable else ''), case_route, fusable, (16, 4096)))
+    ret.append(('compiled-nodes', case_compiled, None, (16, 4096)))
+    return ret
+
+
+CONFIG = """
+import mtcore as mt
+
+def init(app):
+    src = app.nodeSelect('src')
+    seq = app.nodeSeqCheck([mt.ByteSeq(on_seq, b'\\x1b[%ia' % (i), i, False) for i in range(32)], 'seq')
+    src.append_receiver(seq)
+    seq.append_receiver(app.nodeHex(bpl = 16), app.nodeStdout())
+""" + "".join("""
+def on_seq%i(app, dta, b):
+    if dta == %i:
+        app.quit()
+    return [x * %i for x in range(dta)]
+""" % (i, i, i) for i in range(200)) + """
+def on_seq(app, dta, b):
+    pass
+"""
+
+# name -> code run by a new interpreter, %(config)s is a configuration for load_mod()
+STARTUP = [
+    ('import-mtcore', "import mtcore"),
+    ('import-multiterm', "import multiterm"),
+    ('headless-config', "import mtcore as mt\napp = mt.MTHeadless()\nmt.load_mod(%(config)r).init(app)\napp.shutdown()"),
+]
+
+
+def start(code, env, importtime = False):
+    """Run code in a new interpreter, return the time it took and its stderr.
+    """
+    cmd = [sys.executable] + (['-X', 'importtime'] if importtime else []) + ['-c', code]
+    t0 = time.perf_counter()
+    p = subprocess.run(cmd, env = env, stdout = subprocess.DEVNULL, stderr = subprocess.PIPE)
+    dt = time.perf_counter() - t0
+    if p.returncode != 0:
+        raise RuntimeError(p.stderr.decode('utf-8', 'replace'))
+    return dt, p.stderr.decode('utf-8', 'replace')
+
+
+def imports(err, count):
+    """The 'count' slowest imports of the report of -X importtime as (us, us with children,
+    module).
+    """
+    ret = []
+    for line in err.splitlines():
+        if line.startswith('import time:') and not 'self [us]' in line:
+            a, b, name = line[12:].split('|')
+            ret.append((int(a), int(b), name.rstrip()))
+    ret.sort(reverse = True)
+    return ret[:count]
+
+
+def startup(rounds, filt = ''):
+    """Time each STARTUP case cold (the modules of MultiTerm and the configuration are
+    compiled from source) and warm (from the caches), return the results.
+    """
+    res = []
+    here = os.path.dirname(os.path.abspath(__file__))
+    with tempfile.TemporaryDirectory(prefix = 'mtbench') as tmp:
+        envs = dict()
+        for kind in ('cold', 'warm'):
+            src = os.path.join(tmp, kind)
+            os.mkdir(src)
+            for fn in os.listdir(here):
+                if fn.endswith('.py'):
+                    with open(os.path.join(here, fn), 'rb') as f, open(os.path.join(src, fn), 'wb') as g:
+                        g.write(f.read())
+            envs[kind] = dict(os.environ, PYTHONPATH = src, XDG_CACHE_HOME = os.path.join(src, 'cache'))
+            envs[kind].pop('PYTHONDONTWRITEBYTECODE', None)
+        envs['cold']['PYTHONDONTWRITEBYTECODE'] = '1'
+        config = os.path.join(tmp, 'config.py')
+        with open(config, 'w') as f:
+            f.write(CONFIG)
+        print("%-20s %10s %10s" % ("startup", "cold ms", "warm ms"))
+        for name, code in STARTUP:
+            if not filt in name:
+                continue
+            code = code % {'config': config}
+            cold = [start(code, envs['cold'])[0] for r in range(rounds)]
+            start(code, envs['warm'])
+            warm = [start(code, envs['warm'])[0] for r in range(rounds)]
+            res.append({'case': name, 'cold_ms': statistics.median(cold) * 1000,
+                        'warm_ms': statistics.median(warm) * 1000})
+            print("%-20s %10.1f %10.1f" % (name, res[-1]['cold_ms'], res[-1]['warm_ms']))
+        err = start(STARTUP[-1][1] % {'config': config}, envs['warm'], True)[1]
+    print("\nslowest imports (warm, %s)" % (STARTUP[-1][0]))
+    print("%10s %10s  %s" % ("self us", "total us", "module"))
+    for a, b, name in imports(err, 15):
+        print("%10i %10i  %s" % (a, b, name))
+    return res
+
+
+def percentile(srt, p):
+    if len(srt) == 0:
+        return 0
+    return srt[min(len(srt) - 1, int(p / 100.0 * len(srt)))]
+
+
+def run_case(fn, arg, chunk, n, seed, rounds):
+    """Run a case 'rounds' times and return the results of the fastest run, then once
+    more with tracemalloc for the allocations.
+    """
+    best = None
+    for r in range(rounds):
+        app, src, data, done = fn(random.Random(seed), n, arg)
+        mv = memoryview(data)
+        times = []
+        gc.collect()
+        g0 = gc.get_stats()[0]['collections']
+        t0 = time.perf_counter()
+        for i in range(0, len(mv), chunk):
+            ba = mv[i:i+chunk]
+            c0 = time.perf_counter_ns()
+            src.emit(ba)
+            times.append(time.perf_counter_ns() - c0)
+        if not done is None:
+            done()
+        dt = time.perf_counter() - t0
+        g1 = gc.get_stats()[0]['collections']
+        if best is None or dt < best[0]:
+            best = (dt, times, g1 - g0, len(data))
+    dt, times, gcs, size = best
+
+    app, src, data, done = fn(random.Random(seed), n, arg)
+    tracemalloc.start()
+    src.feed(memoryview(data), chunk)
+    if not done is None:
+        done()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    times.sort()
+    return {
+        'bytes': size,
+        'chunk': chunk,
+        'calls': len(times),
+        'seconds': dt,
+        'bytes_per_s': size / dt,
+        'calls_per_s': len(times) / dt,
+        'p50_us': percentile(times, 50) / 1000.0,
+        'p90_us': percentile(times, 90) / 1000.0,
+        'p99_us': percentile(times, 99) / 1000.0,
+        'max_us': times[-1] / 1000.0 if times else 0,
+        'alloc_peak': peak,
+        'gc_gen0': gcs,
+    }
+
+
+def compare_startup(res, old):
+    prev = dict((r['case'], r) for r in old.get('startup', []))
+    print("\n%-20s %10s %10s %10s %10s" % ("startup", "cold old", "cold new", "warm old", "warm new"))
+    for r in res:
+        o = prev.get(r['case'])
+        if not o is None:
+            print("%-20s %10.1f %10.1f %10.1f %10.1f" % (r['case'], o['cold_ms'], r['cold_ms'],
+                                                         o['warm_ms'], r['warm_ms']))
+
+
+def compare(res, old):
+    """Print the change of bytes/s and p99 against an earlier result.
+    """
+    prev = dict()
+    for r in old['results']:
+        prev[(r['case'], r['chunk'])] = r
+    print("\n%-16s %6s %12s %12s %8s %8s" % ("case", "chunk", "MB/s old", "MB/s new", "speed", "p99"))
+    for r in res:
+        o = prev.get((r['case'], r['chunk']))
+        if o is None:
+            continue
+        print("%-16s %6i %12.2f %12.2f %7.2fx %7.2fx" % (r['case'], r['chunk'],
+              o['bytes_per_s'] / 1e6, r['bytes_per_s'] / 1e6,
+              r['bytes_per_s'] / o['bytes_per_s'],
+              r['p99_us'] / o['p99_us'] if o['p99_us'] else 0))
+
+
+def main(argv):
+    ap = argparse.ArgumentParser(description = "benchmarks for the MultiTerm Nodes")
+    ap.add_argument('-o', '--output', help = "write the results to this JSON file")
+    ap.add_argument('-c', '--compare', help = "compare with the results in this JSON file")
+    ap.add_argument('-k', '--filter', default = '', help = "only run cases whose name contains this")
+    ap.add_argument('-n', '--size', type = int, default = 1 << 20, help = "bytes per run")
+    ap.add_argument('-r', '--rounds', type = int, default = 3, help = "runs per case, the fastest counts")
+    ap.add_argument('--seed', type = int, default = 1)
+    ap.add_argument('--quick', action = 'store_true', help = "small data and one round")
+    ap.add_argument('--startup', action = 'store_true', help = "measure the startup time instead")
+    args = ap.parse_args(argv)
+    if args.quick:
+        args.size = 1 << 16
+        args.rounds = 1
+
+    if args.startup:
+        res = startup(max(args.rounds, 5), args.filter)
+        if not args.output is None:
+            with open(args.output, 'w') as f:
+                json.dump({
+                    'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                    'python': platform.python_version(),
+                    'platform': platform.platform(),
+                    'startup': res,
+                }, f, indent = 1)
+        if not args.compare is None:
+            with open(args.compare) as f:
+                compare_startup(res, json.load(f))
+        return
+
+    res = []
+    print("%-16s %6s %10s %12s %9s %9s %10s %6s" % ("case", "chunk", "MB/s", "calls/s", "p50 us",
+                                                   "p99 us", "peak KB", "gc0"))
+    for name, fn, arg, chunks in cases():
+        if not args.filter in name:
+            continue
+        for chunk in chunks:
+            n = args.size if chunk >= 16 else args.size // 16
+            r = run_case(fn, arg, chunk, n, args.seed, args.rounds)
+            r['case'] = name
+            res.append(r)
+            print("%-16s %6i %10.2f %12.0f %9.2f %9.2f %10i %6i" % (name, chunk, r['bytes_per_s'] / 1e6,
+                  r['calls_per_s'], r['p50_us'], r['p99_us'], r['alloc_peak'] // 1024, r['gc_gen0']))
+
+    if not args.output is None:
+        with open(args.output, 'w') as f:
+            json.dump({
+                'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                'python': platform.python_version(),
+                'platform': platform.platform(),
+                'size': args.size,
+                'rounds': args.rounds,
+                'seed': args.seed,
+                'results': res,
+            }, f, indent = 1)
+    if not args.compare is None:
+        with open(args.compare) as f:
+            compare(res, json.load(f))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,298 @@
+#! /usr/bin/python3
+
+"""
+An asyncio runtime for the Nodes of mtcore.  Serial lines (and other objects with a file
+descriptor) are read by loop readers, AsyncNodes may implement recv() as a coroutine.
+"""
+
+import sys
+import asyncio
+import collections
+
+from mtcore import *
+
+
+def current_loop():
+    try:
+        return asyncio.get_running_loop()
+    except RuntimeError:
+        return None
+
+
+class AsyncNode(Node):
+    """A Node whose recv() is a coroutine, e.g. to write to a file or to the network.
+
+    Derived classes implement "async def recv(self, ba, caller)".  Other Nodes call recv()
+    as usual, the data is queued and a task awaits the coroutine for each chunk in order.
+    If more than 'high' bytes are queued, the app pauses reading its sources until the queue
+    is down to 'low' bytes, so a slow Node throttles the sources instead of queueing without
+    limit.  recv() may be called from any thread, the data is handed to the loop of the app.
+    If the coroutine raises, the chunk is dropped and counted in 'errors', the exception is
+    kept in 'error' and reported with MTCore.report_error() (once until a chunk is received
+    again without error), the next chunk is received as usual.
+    """
+    def __init__(self, app, uid = '', high = 1 << 20, low = None):
+        Node.__init__(self, app, uid)
+        self.arecv = self.recv  # the coroutine of the derived class
+        self.recv = self.put    # what the other Nodes call
+        self.high = high
+        self.low = high // 2 if low is None else low
+        self.q = collections.deque()
+        self.qn = 0     # number of bytes in q
+        self.full = False
+        self.task = None
+        self.errors = 0     # number of chunks dropped because the coroutine raised
+        self.error = None   # the last exception of the coroutine
+
+    def put(self, ba, caller):
+        loop = self.app.loop
+        if not loop is None and not loop is current_loop():
+            loop.call_soon_threadsafe(self.put, bytes(ba), caller)
+            return
+        self.q.append((bytes(ba), caller))
+        self.qn += len(ba)
+        if not self.full and self.qn >= self.high:
+            self.full = True
+            self.app.throttle(self, True)
+        self.start()
+
+    def start(self):
+        """Start the task that awaits the queued chunks, once the loop of the app runs.
+        """
+        if self.task is None and len(self.q) != 0 and not self.app.loop is None:
+            self.task = self.app.loop.create_task(self.run())
+
+    async def run(self):
+        try:
+            while len(self.q) != 0:
+                ba, caller = self.q[0]
+                try:
+                    await self.arecv(ba, caller)
+                    self.error = None
+                except Exception as e:
+                    self.errors += 1
+                    if self.error is None:
+                        self.app.report_error(self, e)
+                    self.error = e
+                self.q.popleft()
+                self.qn -= len(ba)
+                if self.full and self.qn <= self.low:
+                    self.full = False
+                    self.app.throttle(self, False)
+        finally:
+            self.task = None
+
+
+class NodeStream(AsyncNode):
+    """Write any received data to an asyncio StreamWriter, e.g. to forward a serial line
+    to a TCP connection.  A slow connection throttles the sources.
+    """
+    def __init__(self, app, writer, uid = '', high = 1 << 20, low = None):
+        AsyncNode.__init__(self, app, uid, high, low)
+        self.writer = writer
+
+    async def recv(self, ba, caller):
+        self.writer.write(ba)
+        await self.writer.drain()
+
+
+class AsyncTerm(MTCore):
+    """Run a graph of Nodes in an asyncio event loop.
+
+    The registered objects that give a file descriptor (fileno()) are read by loop readers
+    and their data is handed to the receivers right away, the others are polled every
+    'poll' seconds.  Pending writes (write_pending()) are done by loop writers.
+    While an AsyncNode has too much data queued, no source is read.
+    The text of the NodeText()s is written to 'out' (default: stdout).
+    """
+    def __init__(self, out = None, poll = 0.01):
+        MTCore.__init__(self, self)     # no ProcHandler, this object takes its part
+        self.out = sys.stdout.buffer if out is None else out
+        self.poll = poll
+        self.loop = None
+        self.new = []       # objects registered before the loop runs
+        self.fds = dict()   # object -> file descriptor
+        self.polled = []
+        self.writing = set()
+        self.congested = set()  # AsyncNodes that have too much data queued
+        self.stopped = None
+
+    # the part of the ProcHandler
+    def add(self, ob):
+        if self.loop is None:
+            self.new.append(ob)
+        else:
+            self.loop.call_soon_threadsafe(self.attach, ob)
+
+    def attach(self, ob):
+        if hasattr(ob, 'attach'):
+            ob.attach(self)
+        fd = ob.fileno() if hasattr(ob, 'fileno') else -1
+        if fd is None or fd < 0:
+            self.polled.append(ob)
+        else:
+            self.fds[ob] = fd
+            if len(self.congested) == 0:
+                self.loop.add_reader(fd, self.on_read, ob)
+
+    def wakeup(self):
+        if not self.loop is None:
+            self.loop.call_soon_threadsafe(self.update)
+
+    def halt(self):
+        self.quit()
+
+    def is_alive(self):
+        return False
+
+    def update(self):
+        for ob, fd in self.fds.items():
+            if not ob in self.writing and hasattr(ob, 'write_pending') and ob.write_pending():
+                self.writing.add(ob)
+                self.loop.add_writer(fd, self.on_write, ob)
+
+    def remove(self, ob):
+        fd = self.fds.pop(ob, None)
+        if not fd is None:
+            self.loop.remove_reader(fd)
+            self.loop.remove_writer(fd)
+        self.writing.discard(ob)
+        if ob in self.polled:
+            self.polled.remove(ob)
+
+    def call(self, ob, fn):
+        """Call fn(), if it raises ob is no longer handled and the error is reported, as
+        ProcHandler.call() does.
+        """
+        try:
+            fn()
+            return True
+        except Exception as e:
+            self.remove(ob)
+            if hasattr(ob, 'failed'):
+                ob.failed(e)
+            self.report_error(ob, e)
+            return False
+
+    def on_write(self, ob):
+        if self.call(ob, ob.write_ready) and not ob.write_pending():
+            self.writing.discard(ob)
+            self.loop.remove_writer(self.fds[ob])
+
+    def on_read(self, ob):
+        self.call(ob, ob.proc)
+        self.drain(ob)
+
+    def drain(self, ob):
+        if hasattr(ob, 'drain'):
+            while ob.rn != 0 and len(self.congested) == 0:
+                ob.drain()
+        if ob in self.fds and hasattr(ob, 'read_pending') and ob.read_pending():
+            self.loop.call_soon(self.on_read, ob)   # it left data unread, see ProcHandler
+
+    async def poller(self):
+        while True:
+            if len(self.congested) == 0:
+                for ob in list(self.polled):
+                    if hasattr(ob, 'write_pending') and ob.write_pending():
+                        self.call(ob, ob.write_ready)
+                    if ob in self.polled:
+                        self.call(ob, ob.proc)
+                    self.drain(ob)
+            await asyncio.sleep(self.poll)
+
+    def throttle(self, node, full):
+        """Called by an AsyncNode when its queue gets full / has room again.
+        """
+        was = len(self.congested) != 0
+        if full:
+            self.congested.add(node)
+        else:
+            self.congested.discard(node)
+        now = len(self.congested) != 0
+        if was == now:
+            return
+        for ob, fd in self.fds.items():
+            if now:
+                self.loop.remove_reader(fd)
+            else:
+                self.loop.add_reader(fd, self.on_read, ob)
+        if not now:
+            # hand over what was read before the sources were paused
+            for ob in self.proc:
+                self.loop.call_soon(self.drain, ob)
+
+    def node_info(self, nd):
+        d = MTCore.node_info(self, nd)
+        if isinstance(nd, AsyncNode):
+            d['depth'] = nd.qn
+            d['errors'] = nd.errors
+            if not nd.error is None:
+                d['error'] = str(nd.error)
+        return d
+
+    # the part of the main loop
+    def post(self):
+        self.loop.call_soon_threadsafe(self.deliver)
+
+    def render(self, col, ba):
+        self.out.write(ba)
+        self.out.flush()
+
+    def call_later(self, sec, fn):
+        self.loop.call_soon_threadsafe(self.loop.call_later, sec, fn)
+
+    def quit(self):
+        if not self.stopped is None:
+            self.loop.call_soon_threadsafe(self.stopped.set)
+
+    async def run(self):
+        """Run until quit() is called.
+        """
+        self.loop = asyncio.get_running_loop()
+        self.stopped = asyncio.Event()
+        for ob in self.new:
+            self.attach(ob)
+        self.new = []
+        for nd in list(self.nodes):
+            if isinstance(nd, AsyncNode):
+                nd.start()  # the data received before the loop ran
+        self.update()
+        self.start_threads()    # the ProcHandlers of ports with thread = True
+        poller = self.loop.create_task(self.poller())
+        try:
+            await self.stopped.wait()
+        finally:
+            poller.cancel()
+            for h in self.handlers:
+                h.halt()
+                h.join()
+            for fd in self.fds.values():
+                self.loop.remove_reader(fd)
+                self.loop.remove_writer(fd)
+            for ob in reversed(self.closers):
+                ob.close()
+            self.closers = []
+            self.out.flush()
+
+    def MainLoop(self):
+        asyncio.run(self.run())
+
+    # Node returning methods
+    def nodeStream(self, writer, uid = '', high = 1 << 20, low = None):
+        ret = NodeStream(self, writer, uid, high, low)
+        return ret
+
+
+if __name__ == '__main__':
+    # run a graph of Nodes in an asyncio loop: the given file must define init(app)
+    if len(sys.argv) != 2:
+        print("usage: %s <config.py>" % (sys.argv[0]))
+        sys.exit(1)
+    app = AsyncTerm()
+    mod = load_mod(sys.argv[1])
+    mod.init(app)
+    try:
+        app.MainLoop()
+    except KeyboardInterrupt:
+        pass
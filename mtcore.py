@@ -0,0 +1,2904 @@
+#! /usr/bin/python3
+
+"""
+The core of MultiTerm: the Nodes, the ProcHandler and the delivery of received data
+to the main loop.  Nothing in here needs a GUI, MTHeadless runs a graph of Nodes
+without one, multiterm.MultiTerm adds the wx front end.
+"""
+
+import os
+import re
+import sys
+import time
+import mmap
+import heapq
+import struct
+import socket
+import itertools
+import selectors
+import weakref
+import warnings
+import threading
+import collections
+
+
+ESCMARKER = 0
+FRAMESTART = 1
+ACK = 2
+NACK = 3
+DATA = 4
+ESC = 255
+ESCB = bytes((ESC,))
+ESCSTUFF = bytes((ESC, ESCMARKER))
+
+# start of a log file written by NodeLogfile in the format 'bin', each record then is
+# LOGREC (time, length of the UID, length of the data), the UID and the data
+LOGMAGIC = b'MTLOG\x01'
+LOGREC = struct.Struct('<dBI')
+# a line of a log file in the format 'text': time, UID and data, both escaped
+LOGTEXT = re.compile(rb'\d+\.\d{6} [^ \n]* ')
+# the first bytes of the files NodeLogfile compresses
+COMPRESSED = ((b'\x1f\x8b', 'gzip'), (b'BZh', 'bz2'), (b'\xfd7zXZ\x00', 'lzma'))
+
+ESCRE = re.compile(re.escape(ESCB))  # also searches memoryviews, they have no find()
+
+htab = (0x30, 0x31, 0x32, 0x33, 0x34, 0x35, 0x36, 0x37, 0x38, 0x39, 0x41, 0x42, 0x43, 0x44, 0x45, 0x46)
+
+
+# print a byte string
+def printb(txt):
+    print(txt.decode('utf-8', 'ignore'))
+
+# return the bytes of a byte array as " HH HH ..." in another byte array
+def hexb(ba):
+    if len(ba) == 0:
+        return bytearray()
+    return bytearray((' ' + ba.hex(' ')).upper(), 'ascii')
+
+# return a hex dump of a byte array as another byte array
+def hdump(ba, bpl = 8):
+    if len(ba) == 0:
+        return bytearray(b'\r')
+    h = (' ' + ba.hex(' ')).upper()
+    w = 3 * bpl
+    ret = bytearray('\r'.join([h[i:i+w] for i in range(0, len(h), w)]), 'ascii')
+    ret.append(13)
+    return ret
+
+
+def rfind(lst, val, start = None):
+    if start is None:
+        start = len(lst) - 1
+    for i in range(start, -1, -1):
+        if lst[i] == val:
+            return i
+    return -1
+
+
+def lfind(lst, val, start = None):
+    if start is None:
+        start = 0
+    for i in range(start, len(lst), 1):
+        if lst[i] == val:
+            return i
+    return -1
+
+
+def list_add(l, v):
+    if v == ESC:
+        l.append(ESC)
+        l.append(ESCMARKER)
+    else:
+        l.append(v)
+
+
+# append an XFER frame containing the byte array ba to the byte array out
+def xfer_frame(ba, out = None):
+    if out is None:
+        out = bytearray()
+    l = len(ba)
+    assert l < 65535, "bytearray too long: %i" % (l)
+    hdr = bytes((l >> 8, l & 255))
+    s = (hdr[0] + hdr[1] + sum(ba)) & 255
+    out.append(ESC)
+    out.append(FRAMESTART)
+    out += hdr.replace(ESCB, ESCSTUFF)
+    if ESCRE.search(ba) is None:
+        out += ba
+    else:
+        out += bytes(ba).replace(ESCB, ESCSTUFF)
+    list_add(out, s)
+    return out
+
+
+class MTException(Exception):
+    pass
+
+class ProcHandler(threading.Thread):
+    """Call proc() of the registered objects from a separate thread.
+
+    Objects that can give a file descriptor (fileno() returns a value >= 0) are
+    waited for with a selector, their proc() is only called when data arrived.
+    If such an object has output pending (write_pending() returns True) then its
+    write_ready() is called as soon as the descriptor becomes writable.
+    All other objects are polled every 'poll' seconds.
+    Objects that buffer data for the GUI (due() does not return None) make the thread
+    ask the app to deliver their data once it is due.  An object that left data unread
+    because too much was waiting for delivery returns True from read_pending() once there
+    is room again, its proc() is then called after the next wakeup().
+    If proc() or write_ready() of an object raises (e.g. a serial line was unplugged), the
+    object is no longer handled, its failed(exception) is called if it has one and the
+    exception is reported with MTCore.report_error().  The other objects go on.
+    """
+    def __init__(self, app, poll = 0.01):
+        threading.Thread.__init__(self)
+        self.app = app
+        self.stop = False
+        self.poll = poll
+        self.sel = selectors.DefaultSelector()
+        self.lock = threading.Lock()
+        self.new = []       # objects registered but not yet picked up by the thread
+        self.polled = []    # objects without a file descriptor
+        self.srcs = []      # objects that buffer data for delivery in the main loop
+        self.ev = dict()    # object -> currently selected events
+        # a socketpair is used to wake up the thread from select()
+        self.wake_rd, self.wake_wr = socket.socketpair()
+        self.wake_rd.setblocking(False)
+        self.wake_wr.setblocking(False)
+        self.sel.register(self.wake_rd, selectors.EVENT_READ, None)
+
+    def add(self, ob):
+        with self.lock:
+            self.new.append(ob)
+        self.wakeup()
+
+    def wakeup(self):
+        try:
+            self.wake_wr.send(b'\0')
+        except (BlockingIOError, OSError):
+            pass    # a wakeup is already pending
+
+    def halt(self):
+        self.stop = True
+        self.wakeup()
+
+    def attach(self):
+        with self.lock:
+            new = self.new
+            self.new = []
+        for ob in new:
+            if hasattr(ob, 'attach'):
+                ob.attach(self)
+            if hasattr(ob, 'due'):
+                self.srcs.append(ob)
+            fd = ob.fileno() if hasattr(ob, 'fileno') else -1
+            if fd is None or fd < 0:
+                self.polled.append(ob)
+            else:
+                self.sel.register(fd, selectors.EVENT_READ, ob)
+                self.ev[ob] = selectors.EVENT_READ
+
+    def remove(self, ob):
+        """Stop handling ob, called in this thread.
+        """
+        for key in list(self.sel.get_map().values()):
+            if key.data is ob:
+                self.sel.unregister(key.fileobj)
+        self.ev.pop(ob, None)
+        if ob in self.polled:
+            self.polled.remove(ob)
+
+    def call(self, ob, fn):
+        try:
+            fn()
+        except Exception as e:
+            self.remove(ob)
+            if hasattr(ob, 'failed'):
+                ob.failed(e)
+            self.app.report_error(ob, e)
+
+    def update(self):
+        for ob, ev in self.ev.items():
+            nev = selectors.EVENT_READ
+            if hasattr(ob, 'write_pending') and ob.write_pending():
+                nev |= selectors.EVENT_WRITE
+            if nev != ev:
+                self.sel.modify(ob.fileno(), nev, ob)
+                self.ev[ob] = nev
+
+    def timeout(self):
+        """Ask the app to deliver buffered data that is due and return how long
+        select() may wait.
+        """
+        tmo = self.poll if self.polled else None
+        if self.app.posted:
+            return tmo  # the app will drain everything and wake us up again
+        now = time.monotonic()
+        post = False
+        held = self.app.held
+        for ob in self.srcs:
+            if ob in held:
+                continue    # the app posts again when there is room, see MTCore.throttle()
+            d = ob.due(now)
+            if d is None:
+                continue
+            if d <= 0:
+                post = True
+            elif tmo is None or d < tmo:
+                tmo = d
+        if post:
+            self.app.post_serial()
+            return self.poll if self.polled else None
+        return tmo
+
+    def run(self):
+        while not self.stop:
+            self.attach()
+            self.update()
+            tmo = self.timeout()
+            for key, ev in self.sel.select(tmo):
+                ob = key.data
+                if ob is None:
+                    try:
+                        while self.wake_rd.recv(256):
+                            pass
+                    except (BlockingIOError, OSError):
+                        pass
+                    continue
+                if ev & selectors.EVENT_WRITE:
+                    self.call(ob, ob.write_ready)
+                if ev & selectors.EVENT_READ and ob in self.ev:
+                    self.call(ob, ob.proc)
+            for ob in self.srcs:
+                if ob in self.ev and hasattr(ob, 'read_pending') and ob.read_pending():
+                    self.call(ob, ob.proc)
+            for ob in list(self.polled):
+                if hasattr(ob, 'write_pending') and ob.write_pending():
+                    self.call(ob, ob.write_ready)
+                if ob in self.polled:
+                    self.call(ob, ob.proc)
+        self.sel.close()
+
+
+# a ByteSeq describes a certain sequence of bytes.  If the same sequence is input into this ByteSeq
+# then it will "match", else the ByteSeq's counter will be reset and the input is scanned again.
+# ByteSeqs are checked from within a NodeSeqcheck, if there is a match then it will call the call target
+# with certain parameters (the app, the given dta parameter and the last byte that was input into this ByteSeq).
+class ByteSeq(object):
+    def __init__(self, cll, bstr, dta = None, forward = False):
+        self.call = cll # call target
+        self.dta = dta # parameter to call
+        self.src = bstr # the sequence as given, used in messages
+        self.forward = forward # if characters shall be forwarded to children if this seq is still possible
+
+        # check if the last byte of the sequence is rather a list than a single byte
+        if bstr[-1] == ord(b']'):
+            ix = bstr.rfind(b'[')
+            if ix < 0:
+                raise MTException(b"ByteSeq '%s': did not find matching '['" % (bstr))
+            self.bstr = bstr[:ix]
+            s = bstr[ix+1:-1]
+            ss = s.split(b",")
+            self.last = []
+            for sss in ss:
+                if len(sss) == 3 and sss[1] == ord(b'-'):
+                    self.last.append( (sss[0], sss[2]) )
+                elif len(sss) == 1:
+                    self.last.append( (sss[0], sss[0]) )
+                else:
+                   raise MTException(b"ByteSeq '%s': did not understand '%s'" % (bstr, sss))
+                q = self.last[-1]
+            self.ln = len(self.bstr) + 1
+        else:
+            self.bstr = bstr # the sequence to match
+            self.last = None
+            self.ln = len(bstr)
+        self.reset()
+
+    # return True if byte b matches this ByteSeq at index ix
+    def mtch(self, b, ix):
+        assert ix < self.ln
+        if not self.last is None:
+            if ix < self.ln-1:
+                return b == self.bstr[ix]
+            else:
+                for rg in self.last:
+                    if rg[0] <= b and b <= rg[1]:
+                        return True
+                return False
+        else:
+            return b == self.bstr[ix]
+
+    # return the set of bytes that match at index ix
+    def byteset(self, ix):
+        assert ix < self.ln
+        if not self.last is None and ix == self.ln-1:
+            return frozenset(b for rg in self.last for b in range(rg[0], rg[1] + 1))
+        return frozenset((self.bstr[ix],))
+
+    def reset(self):
+        self.ix = 0
+        self.match = False
+        self.last_byte = bytearray()
+
+    def received(self, b):
+        if self.ix < self.ln:
+            if self.mtch(b, self.ix):
+                self.ix += 1
+                if self.ix == self.ln:
+                    self.last_byte.append(b)
+                    self.match = True
+            else:
+                self.reset()
+        else:
+            self.reset()
+
+    def matched(self):
+        return self.match
+
+
+# The Node, this is the base class for all other Nodes
+class Node(object):
+    """This is the base class for all other nodes.  It is meant to be derived and not to be used directly.
+
+A Node should know the MultiTerm app that it is used in and optionally can have a UID, a user chosen name
+that can be used to identify this node.
+
+A Node can receive input data using the method recv(ba, caller_uid).  "ba" is a bytes-like object
+containing 0 or more bytes that this node shall process, usually a read-only memoryview of the buffer
+the data was read into.  It is only valid during the call: a Node that keeps the data must copy it
+(bytes(ba)), a Node that passes it on unchanged passes on ba itself.  A view kept beyond the call
+(e.g. ba[:]) keeps a pooled read buffer from being reused (see BufferPool), it is not an error
+but costs a new buffer.  memoryviews have no find(),
+replace() or decode() and "x in ba" only finds single byte values, use re, bytes(ba) or
+str(ba, 'utf-8') for these.
+
+Other Nodes can be set as receivers of this node by calling Node.append_receiver().  This method can optionally
+take an identifier that is handled depending on the nodes behavior.  Most often, this parameter is omitted.
+Processed data of a node will then behanded to the registered receiver nodes by calling their method recv(ba, caller_uid).
+The parameter "caller_uid" will be the UID given to the calling node in its constructor.
+"""
+    def __init__(self, app, uid = ''):
+        self.ch = dict()
+        self.ch['_'] = []
+        self.uid = uid
+        self.app = app
+        self.ba = bytearray()
+        if hasattr(app, 'register_node'):
+            app.register_node(self)
+
+    def append_receiver(self, *ch, capacity = 0, policy = 'block'):
+        """This function can be used to register receivers (other Nodes) to this Node.
+Anything this Node wants to output goes to its receivers.
+Receivers can register with a key (as first parameter, '_' if no key is given).
+This class can use the receivers for different purposes.
+With a 'capacity' (in bytes) each receiver is connected by a NodeQueue with the given 'policy'.
+"""
+        if len(ch) >= 2 and isinstance(ch[0], str):
+            k = ch[0]
+            a = ch[1:]
+        else:
+            k = '_'
+            a = ch
+        if capacity > 0:
+            a = [NodeQueue(self.app, c, c.uid, capacity, policy) for c in a]
+        if not k in self.ch:
+            self.ch[k] = []
+
+        lst = self.ch[k]
+        lst.extend(a)
+        ins = getattr(self.app, 'instr', None)
+        if not ins is None:
+            ins.node(self)
+        try:
+            self.changed(*lst[len(lst)-len(a):])
+        except MTException:
+            del lst[len(lst)-len(a):]  # the edges would close a cycle
+            self.changed()
+            raise
+
+    def changed(self, *edges):
+        """Called when the receivers ('edges': the new ones) or the routing of this Node
+        changed, the app then compiles this part of the graph again if it was compiled (see
+        MTCore.compile()).
+        """
+        fn = getattr(self.app, 'graph_changed', None)
+        if not fn is None:
+            fn(self, edges)
+
+    def emit(self, ba):
+        """Hand ba to the receivers registered without key.  MTCore.compile() replaces this
+        by a function made for the receivers of this Node.
+        """
+        for ch in self.ch['_']:
+            ch.recv(ba, self.uid)
+
+    def fuse(self, caller):
+        """Tell MTCore.compile() what recv(ba, caller) does for data from 'caller':
+        None: anything (recv() must be called), False: nothing, True: emit(ba),
+        a function xf: emit(xf(ba)) unless xf(ba) returns None.
+        """
+        return None
+
+    def recv(self, ba, caller):
+        """To be implemented in the derived class
+        """
+        pass
+
+    def proc(self):
+        """To be implemented in the derived class
+        """
+        pass
+
+    def close(self):
+        """To be implemented in the derived class, called when the app ends if the Node
+        was registered with MultiTerm.register_close().
+        """
+        pass
+
+
+def edge_dst(c):
+    """Return the Node at the end of an entry of a list of receivers, behind an EdgeProbe
+    or a NodeQueue.
+    """
+    if isinstance(c, EdgeProbe):
+        c = c.dst
+    if isinstance(c, NodeQueue):
+        c = c.node
+    return c
+
+
+class NodeSelect(Node):
+    """Forwards the data of the enabled callers to its receivers.  Callers are enabled /
+    disabled by their UID, the ones not mentioned follow default_enable().  With
+    route(caller, *receivers) the data of a caller only go to some of the receivers.
+
+    The receivers of each caller are kept in a table (caller -> indices into the list of
+    receivers) that is made again when the routing changes and replaced in one step, so
+    recv() sees either the old or the new routing and switching is cheap enough to be done
+    from a ByteSeq callback.  In a compiled graph only a switch that changes how a caller is
+    fused (all receivers, none or some of them) compiles this Node and the Nodes it is fused
+    into again.  If 'fusable' is False it is never fused.
+    """
+    def __init__(self, app, uid = '', fusable = True):
+        Node.__init__(self, app, uid)
+        self.d = dict()
+        self.df = True
+        self.rules = dict()     # caller -> set of receivers
+        self.fusable = fusable
+        self.table = (dict(), ())   # (caller -> indices, indices for other callers)
+        self.fused = dict()         # caller -> what fuse() answered when compiled
+
+    def default_enable(self, df):
+        self.df = df
+        self.switched()
+
+    def enable(self, k):
+        self.d[k] = True
+        self.switched()
+
+    def disable(self, k):
+        self.d[k] = False
+        self.switched()
+
+    def route(self, caller, *receivers):
+        """Send the data of 'caller' only to these receivers, they are appended to the
+        receivers if they are not yet.  route(caller) sends them to all receivers again.
+        """
+        if len(receivers) == 0:
+            self.rules.pop(caller, None)
+        else:
+            self.rules[caller] = frozenset(receivers)
+        known = set(edge_dst(c) for c in self.ch['_'])
+        new = [r for r in receivers if not r in known]
+        if len(new) != 0:
+            self.append_receiver(*new)
+        else:
+            self.switched()
+
+    def rebuild(self):
+        lst = self.ch['_']
+        every = tuple(range(len(lst)))
+        dst = [edge_dst(c) for c in lst]
+        tbl = dict()
+        for k in set(self.d) | set(self.rules):
+            if not self.d.get(k, self.df):
+                tbl[k] = ()
+            elif k in self.rules:
+                r = self.rules[k]
+                tbl[k] = tuple(i for i in every if dst[i] in r)
+            else:
+                tbl[k] = every
+        self.table = (tbl, every if self.df else ())
+
+    def changed(self, *edges):
+        self.rebuild()
+        Node.changed(self, *edges)
+
+    def switched(self):
+        self.rebuild()
+        for k, v in list(self.fused.items()):
+            if self.answer(k) != v:
+                self.fused.clear()
+                Node.changed(self)
+                break
+
+    def answer(self, caller):
+        tbl, df = self.table
+        idx = tbl.get(caller, df)
+        if len(idx) == 0:
+            return False
+        if len(idx) == len(self.ch['_']):
+            return True
+        return None
+
+    def fuse(self, caller):
+        if not self.fusable:
+            return None
+        ret = self.answer(caller)
+        self.fused[caller] = ret
+        return ret
+
+    def recv(self, ba, caller):
+        tbl, df = self.table
+        lst = self.ch['_']
+        for i in tbl.get(caller, df):
+            lst[i].recv(ba, self.uid)
+
+
+class NodeHex(Node):
+    """A Node that converts its input to hexadecimal numbers and outputs these to its receivers.
+    If 'bpl' is given, a CR is output after every 'bpl' bytes, the column is kept across calls
+    so a long stream is wrapped correctly.  If 'offset' is set, each line starts with the
+    stream offset of its first byte.
+    """
+    def __init__(self, app, uid = '', bpl = 0, offset = False):
+        Node.__init__(self, app, uid)
+        self.bpl = bpl
+        self.offset = offset
+        self.pos = 0    # number of bytes converted so far
+
+    def fuse(self, caller):
+        return self.xform
+
+    def recv(self, ba, caller):
+        self.emit(self.xform(ba))
+
+    def xform(self, ba):
+        n = len(ba)
+        if self.bpl == 0:
+            b = hexb(ba)
+            self.pos += n
+        else:
+            b = bytearray()
+            i = 0
+            while i < n:
+                col = self.pos % self.bpl
+                if col == 0 and self.offset:
+                    b += b'%08X:' % (self.pos)
+                k = min(n - i, self.bpl - col)
+                b += hexb(ba[i:i+k])
+                i += k
+                self.pos += k
+                if col + k == self.bpl:
+                    b.append(13)
+        return b
+
+
+class NodeXferOut(Node):
+    """Convert an input bytearray to a XFER packet
+    Several packets can be converted at once with recv_many() or send(), they are
+    handed to the receivers in one buffer.
+    """
+    def __init__(self, app, uid = ''):
+        Node.__init__(self, app, uid)
+
+    def fuse(self, caller):
+        return xfer_frame
+
+    def recv(self, ba, caller):
+        self.emit(xfer_frame(ba))
+
+    def recv_many(self, lba, caller = ''):
+        """Convert each bytearray in lba to a packet, output all packets at once.
+        """
+        b = bytearray()
+        for ba in lba:
+            xfer_frame(ba, b)
+        self.emit(b)
+
+    def send(self, data, size = 1024, bsize = 65536):
+        """Split data into packets of 'size' bytes and output these in buffers of about
+        'bsize' bytes, e.g. to transfer a file.
+        """
+        b = bytearray()
+        for i in range(0, len(data), size):
+            xfer_frame(data[i:i+size], b)
+            if len(b) >= bsize:
+                self.emit(b)
+                b = bytearray()
+        if len(b) != 0:
+            self.emit(b)
+
+
+class NodeXferIn(Node):
+    """Scan the input bytearrays to an XFER packet.  The packet will be handled differently
+    from the other data.
+    Plain data between packets is searched for the next ESC in bulk and a packets payload
+    is copied in one piece, the state machine rx() only runs at packet headers and escapes.
+    If 'trace' is set, it is called as trace(byte, state) for each input byte.
+    TODO: What happens if a packet is not recognized?
+    TODO: Are the other data just forwarded to the children?
+    """
+    def __init__(self, app, uid = ''):
+        Node.__init__(self, app, uid)
+        self.reset()
+        self.pch = []
+        self.trace = None
+
+    def add_packet_receiver(self, ob):
+        self.pch.append(ob)
+
+    def no_packet(self):
+        self.p = bytearray()
+        self.st = 0
+        self.l = 0
+        self.s = 0
+        self.ix = 0
+        self.esc = False
+
+    def reset(self):
+        self.ba = bytearray()
+        self.no_packet()
+
+# st:
+# 0: no packet, just normal bytes
+# 1: FRAMESTART
+# 2: LEN_HI
+# 3: LEN_LO
+# 4: DATA
+# 5: CSUM
+    def rx(self, v):
+        if not self.trace is None:
+            self.trace(v, self.st)
+        if self.st == 0:
+            if v == ESC:
+                self.st = 1
+                self.esc = True
+            else:
+                self.ba.append(v)
+            return
+
+        if self.esc:
+            if v == ESCMARKER:
+                v = ESC
+            elif v == FRAMESTART and self.st != 1:
+                # a new packet starts within a packet, the current one is broken
+                self.no_packet()
+                self.st = 2
+                return
+            self.esc = False
+        else:
+            if v == ESC:
+                self.esc = True
+                return
+
+        if self.st == 1:
+            if v == FRAMESTART:
+                self.st = 2
+            else:
+                self.no_packet()    
+
+        elif self.st == 2:
+            self.s = v
+            self.l = 256 * v
+            self.st = 3
+
+        elif self.st == 3:
+            self.s += v
+            self.l += v
+            if self.l == 0:
+                self.st = 5
+            else:
+                self.st = 4
+
+        elif self.st == 4:
+            self.s += v
+            self.p.append(v)
+            self.ix += 1
+            if self.ix >= self.l:
+                self.st = 5
+
+        elif self.st == 5:
+            if v == self.s & 255:
+                if len(self.ba) != 0:
+                    self.emit(self.ba)
+                    self.ba = bytearray()
+
+                for ch in self.pch:
+                    ch.recv(self.p, self.uid)
+                self.reset()
+            else:
+                self.no_packet()
+
+    def scan(self, ba):
+        n = len(ba)
+        i = 0
+        while i < n:
+            if self.st == 0:
+                m = ESCRE.search(ba, i)
+                if m is None:
+                    self.ba += ba[i:]
+                    return
+                j = m.start()
+                self.ba += ba[i:j]
+                self.st = 1
+                self.esc = True
+                i = j + 1
+            elif self.st == 4 and not self.esc:
+                end = min(n, i + self.l - self.ix)
+                m = ESCRE.search(ba, i, end)
+                j = end if m is None else m.start()
+                if j == i:
+                    self.rx(ba[i])
+                    i += 1
+                    continue
+                seg = ba[i:j]
+                if self.ix == 0 and j - i == self.l:
+                    self.p = seg    # the whole payload, no need to copy it
+                else:
+                    self.p += seg
+                self.s += sum(seg)
+                self.ix += j - i
+                if self.ix >= self.l:
+                    self.st = 5
+                i = j
+            else:
+                self.rx(ba[i])
+                i += 1
+
+    def recv(self, ba, caller):
+        ln = len(ba)
+        if ln == 0:
+            return
+        if self.trace is None:
+            if self.st == 0 and len(self.ba) == 0 and ESCRE.search(ba) is None:
+                # plain data only, pass it on as it is
+                self.emit(ba)
+                return
+            self.scan(ba)
+            if self.st == 5 and not isinstance(self.p, bytearray):
+                self.p = bytearray(self.p)  # the checksum comes with the next call
+        else:
+            for x in ba:
+                self.rx(x)
+        if len(self.ba) != 0:
+            self.emit(self.ba)
+            self.ba = bytearray()
+
+
+class NodeFunc(Node):
+    """Call the function fn(ba, caller) with any received data.
+    """
+    def __init__(self, app, fn, uid = ''):
+        Node.__init__(self, app, uid)
+        self.fn = fn
+
+    def recv(self, ba, caller):
+        self.fn(ba, caller)
+
+
+class NodeXferLink(Node):
+    """Reliable transfer of data over XFER packets (XFER v2).
+
+    Data given to recv() is split into packets of up to 'size' bytes.  Each packet
+    contains a type (DATA, ACK or NACK), a sequence number and a CRC-32 and is sent as
+    the payload of an XFER packet to the receivers of this Node (the serial line).
+    Up to 'window' packets may wait for their ACK.  A packet is sent again if the other
+    side answers with a NACK or if there is no ACK within 'timeout' seconds.  After
+    'retries' attempts the transfer is given up and on_error(node) is called in the main
+    loop if set.
+
+    The data coming from the serial line must be given to the Node 'wire'.  The packets
+    received from the other side are handed in order to the packet receivers
+    (add_packet_receiver()), other data from the line goes to the receivers that were
+    registered with the key 'plain'.  The timeouts are checked with app.call_later() only
+    while packets wait for their ACK, so an idle link costs nothing.
+    """
+    def __init__(self, app, uid = '', window = 32, timeout = 1.0, size = 1024, retries = 20):
+        Node.__init__(self, app, uid)
+        assert 0 < window <= 128, "window must be within half the sequence numbers"
+        assert 0 < size <= 65528, "size too big: %i" % (size)
+        self.window = window
+        self.timeout = timeout
+        self.size = size
+        self.retries = retries
+        self.on_error = None
+        import zlib
+        self.crc32 = zlib.crc32
+        self.lock = threading.RLock()
+        self.pch = []
+        self.dec = NodeXferIn(app, uid)
+        self.dec.ch['_'] = self.ch.setdefault('plain', [])
+        self.dec.add_packet_receiver(NodeFunc(app, self.packet))
+        self.wire = NodeFunc(app, self.wire_recv, uid)
+        self.tx = bytearray()   # XFER packets to be output
+        # sending side
+        self.q = collections.deque()    # data waiting for a free slot in the window
+        self.una = 0    # oldest packet not yet acknowledged
+        self.nxt = 0    # next packet number
+        self.out = dict()   # packet number -> [packet, time sent, retries]
+        self.sched = False  # a call to expire() is scheduled
+        # receiving side
+        self.rn = 0     # next packet number to hand to the packet receivers
+        self.rbuf = dict()  # packet number -> data received out of order
+        self.nacked = set()
+        self.stats = dict.fromkeys(('sent', 'resent', 'acked', 'nacked', 'crcerr', 'dup', 'delivered'), 0)
+
+    def add_packet_receiver(self, ob):
+        self.pch.append(ob)
+
+    def changed(self, *edges):
+        Node.changed(self, *edges)
+        self.dec.changed()  # it hands the other data to the 'plain' receivers of this Node
+
+    def done(self):
+        """Return True if all data was sent and acknowledged.
+        """
+        return len(self.q) == 0 and len(self.out) == 0
+
+    def frame(self, t, seq, ba = b''):
+        p = bytearray((t, seq))
+        p += ba
+        p += self.crc32(p).to_bytes(4, 'big')
+        return p
+
+    def flush(self):
+        if len(self.tx) != 0:
+            b = self.tx
+            self.tx = bytearray()
+            self.emit(b)
+
+    def recv(self, ba, caller):
+        with self.lock:
+            for i in range(0, len(ba), self.size):
+                self.q.append(bytes(ba[i:i+self.size]))
+            self.pump()
+            self.flush()
+            self.arm()
+
+    def pump(self):
+        now = time.monotonic()
+        while len(self.q) != 0 and self.nxt - self.una < self.window:
+            p = self.frame(DATA, self.nxt & 255, self.q.popleft())
+            self.out[self.nxt] = [p, now, 0]
+            xfer_frame(p, self.tx)
+            self.nxt += 1
+            self.stats['sent'] += 1
+
+    def resend(self, n, now):
+        e = self.out[n]
+        e[2] += 1
+        if e[2] > self.retries:
+            self.fail()
+            return
+        e[1] = now
+        xfer_frame(e[0], self.tx)
+        self.stats['resent'] += 1
+
+    def fail(self):
+        self.q.clear()
+        self.out.clear()
+        self.una = self.nxt
+        self.app.call_later(0, self.report)
+
+    def report(self):
+        if not self.on_error is None:
+            self.on_error(self)
+
+    def arm(self):
+        if len(self.out) != 0 and not self.sched:
+            self.sched = True
+            first = min(e[1] for e in self.out.values())
+            self.app.call_later(max(first + self.timeout - time.monotonic(), 0), self.expire)
+
+    def expire(self):
+        self.sched = False
+        self.tick()
+
+    def tick(self, now = None):
+        if now is None:
+            now = time.monotonic()
+        with self.lock:
+            for n in sorted(self.out):
+                if n in self.out and now - self.out[n][1] >= self.timeout:
+                    self.resend(n, now)
+            self.flush()
+            self.arm()
+
+    def wire_recv(self, ba, caller):
+        with self.lock:
+            self.dec.recv(ba, caller)
+            self.flush()
+            self.arm()
+
+    def packet(self, p, caller):
+        if len(p) < 6 or self.crc32(p[:-4]) != int.from_bytes(p[-4:], 'big'):
+            self.stats['crcerr'] += 1
+            return
+        t = p[0]
+        seq = p[1]
+        if t == DATA:
+            d = (seq - self.rn) & 255
+            if d >= self.window:
+                # an old packet, our ACK got lost
+                self.stats['dup'] += 1
+                xfer_frame(self.frame(ACK, seq), self.tx)
+                return
+            n = self.rn + d
+            if n in self.rbuf:
+                self.stats['dup'] += 1
+            else:
+                self.rbuf[n] = bytes(p[2:-4])
+            xfer_frame(self.frame(ACK, seq), self.tx)
+            for m in range(self.rn, n):
+                if not m in self.rbuf and not m in self.nacked:
+                    xfer_frame(self.frame(NACK, m & 255), self.tx)
+                    self.nacked.add(m)
+            while self.rn in self.rbuf:
+                ba = self.rbuf.pop(self.rn)
+                self.nacked.discard(self.rn)
+                self.rn += 1
+                self.stats['delivered'] += 1
+                for ch in self.pch:
+                    ch.recv(ba, self.uid)
+        elif t == ACK or t == NACK:
+            n = self.una + ((seq - self.una) & 255)
+            if not n in self.out:
+                return
+            if t == ACK:
+                del self.out[n]
+                self.stats['acked'] += 1
+                while self.una < self.nxt and not self.una in self.out:
+                    self.una += 1
+                self.pump()
+            else:
+                self.stats['nacked'] += 1
+                self.resend(n, time.monotonic())
+
+
+class NodeLinebuffer(Node):
+    """Buffer input data until a line end is detected, then output them all at once.
+    The line end is 'term', a byte string or a tuple of byte strings (e.g. (b'\r', b'\n')),
+    all data up to the last line end is output.  A line that reaches 'max_line' bytes is
+    output without line end, so is a line that waited for its end for 'timeout' seconds
+    (0 means no limit for both).
+    """
+    def __init__(self, app, uid = '', term = b'\r', max_line = 0, timeout = 0):
+        Node.__init__(self, app, uid)
+        self.ba = bytearray()
+        if isinstance(term, (bytes, bytearray)):
+            term = (term,)
+        self.term = tuple(bytes(t) for t in term)
+        self.tl = max(len(t) for t in self.term)
+        self.max_line = max_line
+        self.timeout = timeout
+        self.t = 0  # time when the data in self.ba started
+        self.sched = False  # a call to expire() is scheduled
+
+    def out(self, end):
+        f = memoryview(self.ba)[:end]
+        self.emit(f)
+        try:
+            f.release()
+            del self.ba[:end]   # cheap, a bytearray only moves its start
+        except BufferError:
+            self.ba = self.ba[end:] # a receiver kept a view of it
+
+    def ends_line(self, ba):
+        for t in self.term:
+            if len(ba) >= len(t) and ba[len(ba)-len(t):] == t:
+                return True
+        return False
+
+    def recv(self, ba, caller):
+        if len(self.ba) == 0 and len(ba) != 0 and self.ends_line(ba) and \
+                (self.max_line == 0 or len(ba) < self.max_line):
+            # complete lines only, pass them on as they are
+            self.emit(ba)
+            return
+        start = len(self.ba)
+        self.ba += ba
+        # only search the new bytes and those a line end may have started in
+        lo = max(0, start - self.tl + 1)
+        end = -1
+        for t in self.term:
+            ix = self.ba.rfind(t, lo)
+            if ix >= 0 and ix + len(t) > end:
+                end = ix + len(t)
+        if end > 0:
+            self.out(end)
+        if self.max_line != 0 and len(self.ba) >= self.max_line:
+            self.out(len(self.ba))
+        if len(self.ba) != 0 and (start == 0 or end > 0):
+            self.t = time.monotonic()
+            if self.timeout > 0 and not self.sched:
+                self.sched = True
+                self.app.call_later(self.timeout, self.expire)
+
+    def expire(self):
+        self.sched = False
+        if len(self.ba) == 0:
+            return
+        dt = self.t + self.timeout - time.monotonic()
+        if dt > 0:
+            self.sched = True
+            self.app.call_later(dt, self.expire)
+        else:
+            self.out(len(self.ba))
+
+
+class NodeSeqCheck(Node):
+    """Check the input streams against a list of byte sequences (lobs).
+    If a sequence is detected then call the registered callout.
+
+    At construction the list is compiled into a single transition table, so each input
+    byte costs one table lookup regardless of the number of sequences.  Sequences that
+    match the same input, are a prefix of or are contained in another sequence are
+    reported as a warning, or as an MTException if 'strict' is set.
+    """
+    MAX_STATES = 4096
+
+    def __init__(self, app, lobs, uid = '', strict = False):
+        Node.__init__(self, app, uid)
+        self.esc = 27
+        self.lobs = lobs # list of byte sequences
+        self.conflicts = self.check()
+        if len(self.conflicts) != 0:
+            if strict:
+                raise MTException("NodeSeqCheck: " + "; ".join(self.conflicts))
+            for c in self.conflicts:
+                warnings.warn("NodeSeqCheck: " + c)
+        self.compile()
+
+    def check(self):
+        """Return a list of messages about sequences that overlap each other.
+        """
+        ret = []
+        sets = [[bs.byteset(ix) for ix in range(bs.ln)] for bs in self.lobs]
+        for i, a in enumerate(sets):
+            for j, b in enumerate(sets):
+                if i == j or len(a) == 0 or len(a) > len(b) or (len(a) == len(b) and i > j):
+                    continue
+                for o in range(len(b) - len(a) + 1):
+                    if all(a[k] & b[o + k] for k in range(len(a))):
+                        sa = self.lobs[i].src
+                        sb = self.lobs[j].src
+                        if len(a) == len(b):
+                            ret.append("%r and %r match the same input" % (sa, sb))
+                        elif o == 0:
+                            ret.append("%r is a prefix of %r" % (sa, sb))
+                        else:
+                            ret.append("%r is contained in %r" % (sa, sb))
+                        break
+        return ret
+
+    def compile(self):
+        """Build the transition table.  A state is the tuple of the match positions
+        of all sequences, only the states reachable from the start are built.
+        Each table entry is (next state * 256, forward, sequences that matched).
+        """
+        lobs = self.lobs
+        sets = [[bs.byteset(ix) for ix in range(bs.ln)] for bs in lobs]
+        # bytes that behave the same for all sequences at all positions share one class
+        classes = dict()
+        for b in range(256):
+            sig = tuple(b in st for sts in sets for st in sts)
+            classes.setdefault(sig, []).append(b)
+        start = (0,) * len(lobs)
+        ids = {start: 0}
+        states = [start]
+        tab = []
+        si = 0
+        while si < len(states):
+            if len(states) > self.MAX_STATES:
+                self.tab = None # too complex, check the sequences one by one
+                return
+            state = states[si]
+            row = [None] * 256
+            for cls in classes.values():
+                b = cls[0]
+                nxt = []
+                fw = True
+                act = []
+                for i, bs in enumerate(lobs):
+                    ix = state[i]
+                    if ix < bs.ln and b in sets[i][ix]:
+                        ix += 1
+                    else:
+                        ix = 0
+                    if ix != 0 and bs.forward == False:
+                        fw = False
+                    if ix != 0 and ix == bs.ln:
+                        act.append(bs)
+                        ix = 0
+                    nxt.append(ix)
+                nxt = tuple(nxt)
+                if not nxt in ids:
+                    ids[nxt] = len(states)
+                    states.append(nxt)
+                ent = (ids[nxt] * 256, fw, tuple(act) if len(act) != 0 else None)
+                for b in cls:
+                    row[b] = ent
+            tab.extend(row)
+            si += 1
+        self.tab = tab
+        self.st = 0
+        # in the start state most bytes are just forwarded, find the others with a regex
+        hot = [b for b in range(256) if tab[b] != (0, True, None)]
+        if len(hot) == 256:
+            self.find = None
+        elif len(hot) == 0:
+            self.find = re.compile(b'(?!)').search
+        else:
+            self.find = re.compile(b'[' + b''.join(re.escape(bytes((b,))) for b in hot) + b']').search
+
+    def send(self, ba, start, end):
+        """Forward ba[start:end] to the receivers, ba itself if it is forwarded completely.
+        """
+        if start == end:
+            return
+        if start != 0 or end != len(ba):
+            ba = ba[start:end]
+        self.emit(ba)
+
+    def recv(self, ba, caller):
+        if self.tab is None:
+            return self.recv_seq(ba, caller)
+        tab = self.tab
+        find = self.find
+        st = self.st
+        n = len(ba)
+        run = 0 # start of the bytes not yet forwarded
+        i = 0
+        while i < n:
+            if st == 0 and not find is None:
+                m = find(ba, i)
+                if m is None:
+                    break
+                i = m.start()
+            b = ba[i]
+            st, fw, act = tab[st + b]
+            if not act is None:
+                self.send(ba, run, i)
+                run = i
+                self.st = st
+                for bs in act:
+                    bs.call(self.app, bs.dta, bytearray((b,)))
+                st = self.st
+            if not fw:
+                self.send(ba, run, i)
+                run = i + 1
+            i += 1
+        self.st = st
+        self.send(ba, run, n)
+
+    def recv_seq(self, ba, caller):
+        for b in ba:
+            forward = True
+            for bs in self.lobs:
+                bs.received(b)
+                if bs.ix != 0 and bs.forward == False:
+                    forward = False
+                if bs.matched():
+                    bs.call(self.app, bs.dta, bs.last_byte)
+                    bs.reset()
+
+            if forward:
+                bba = bytearray()
+                bba.append(b)
+                self.emit(bba)
+
+
+class NodeLogfile(Node):
+    """Write all incoming data into a log file.
+    The data is written by a separate thread, which takes all chunks waiting at once.  recv()
+    never waits for the thread: when more than 'max_pending' bytes are waiting, the new
+    data is dropped and counted in 'dropped'.  If writing fails, the exception is kept in 'error' and reported with
+    MTCore.report_error(), all data from then on is counted in 'dropped'.
+
+    fmt: 'raw' writes the data only, 'text' writes a line "time uid data" per chunk with
+    the UID and the data escaped (spaces in the UID as \\x20), 'bin' writes records of LOGREC, the UID and the data.
+    The file is rotated when it reached 'max_size' bytes (uncompressed) or is 'max_age'
+    seconds old, the old files are kept as fname.1 ... fname.<backups>.
+    compress: None, 'gzip', 'bz2' or 'lzma', the file is compressed with 'level'.
+    The file is flushed and closed when the app ends.
+    """
+    def __init__(self, app, fname, uid = '', fmt = 'raw', max_size = 0, max_age = 0, backups = 5,
+            compress = None, level = 6, max_pending = 1 << 24):
+        Node.__init__(self, app, uid)
+        if not fmt in ('raw', 'text', 'bin'):
+            raise MTException("NodeLogfile: unknown format '%s'" % (fmt))
+        if not compress in (None, 'gzip', 'bz2', 'lzma'):
+            raise MTException("NodeLogfile: unknown compression '%s'" % (compress))
+        self.fname = fname
+        self.fmt = fmt
+        self.max_size = max_size
+        self.max_age = max_age
+        self.backups = backups
+        self.compress = compress
+        self.level = level
+        self.error = None   # the exception if writing failed
+        self.dropped = 0    # bytes not written, the queue was full or writing failed
+        self.fd = None
+        self.open()
+        self.max_pending = max_pending
+        self.cv = threading.Condition()
+        self.q = collections.deque()    # (time, caller, bytes), an Event for flush(), None to end
+        self.qn = 0     # number of bytes in q
+        self.thr = threading.Thread(target = self.run, daemon = True)
+        self.thr.start()
+        app.register_close(self)
+
+    def open(self):
+        if self.compress == 'gzip':
+            import gzip
+            self.fd = gzip.open(self.fname, "wb", compresslevel = self.level)
+        elif self.compress == 'bz2':
+            import bz2
+            self.fd = bz2.open(self.fname, "wb", compresslevel = self.level)
+        elif self.compress == 'lzma':
+            import lzma
+            self.fd = lzma.open(self.fname, "wb", preset = self.level)
+        else:
+            self.fd = open(self.fname, "wb")
+        self.size = 0
+        self.t0 = time.time()
+        if self.fmt == 'bin':
+            self.fd.write(LOGMAGIC)
+
+    def rotate(self):
+        self.fd.close()
+        if self.backups > 0:
+            for i in range(self.backups - 1, 0, -1):
+                if os.path.exists("%s.%i" % (self.fname, i)):
+                    os.replace("%s.%i" % (self.fname, i), "%s.%i" % (self.fname, i + 1))
+            os.replace(self.fname, self.fname + ".1")
+        self.open()
+
+    def record(self, t, caller, ba):
+        if self.fmt == 'raw':
+            return ba
+        uid = str(getattr(caller, 'uid', caller))
+        if self.fmt == 'bin':
+            uid = uid.encode('utf-8', 'replace')[:255]
+            return LOGREC.pack(t, len(uid), len(ba)) + uid + ba
+        # the fields are separated by spaces, so they are escaped in the UID, too
+        uid = uid.encode('unicode_escape').replace(b' ', b'\\x20')
+        return b'%.6f %s %s\n' % (t, uid, ba.decode('latin-1').encode('unicode_escape'))
+
+    def run(self):
+        end = False
+        while not end:
+            with self.cv:
+                if len(self.q) == 0:
+                    self.cv.wait(1.0)
+                lst = self.q
+                self.q = collections.deque()
+            if len(lst) == 0 and self.error is None:
+                self.fd.flush()
+            n = 0
+            for it in lst:
+                if it is None:
+                    end = True
+                elif isinstance(it, threading.Event):
+                    if self.error is None:
+                        self.fd.flush()
+                    it.set()
+                else:
+                    n += len(it[2])
+                    self.write(it)
+            with self.cv:
+                self.qn -= n
+        try:
+            self.fd.close()
+        except Exception:
+            pass    # already reported
+
+    def write(self, it):
+        if not self.error is None:
+            self.dropped += len(it[2])
+            return
+        try:
+            if (self.max_size != 0 and self.size >= self.max_size) or \
+                    (self.max_age != 0 and it[0] - self.t0 >= self.max_age):
+                self.rotate()
+            ba = self.record(*it)
+            self.fd.write(ba)
+            self.size += len(ba)
+        except Exception as e:
+            self.error = e
+            self.dropped += len(it[2])
+            if hasattr(self.app, 'report_error'):
+                self.app.report_error(self, e)
+
+    def put(self, it):
+        with self.cv:
+            self.q.append(it)
+            if len(self.q) == 1:
+                self.cv.notify()
+
+    def recv(self, ba, caller):
+        n = len(ba)
+        with self.cv:
+            if not self.error is None or self.qn + n > self.max_pending:
+                self.dropped += n
+                return
+            self.qn += n
+            self.q.append((time.time(), caller, bytes(ba)))
+            if len(self.q) == 1:
+                self.cv.notify()
+
+    def flush(self):
+        """Wait until all data received so far is written to the file.
+        """
+        ev = threading.Event()
+        self.put(ev)
+        ev.wait()
+
+    def close(self):
+        if self.thr.is_alive():
+            self.put(None)
+            self.thr.join()
+
+
+class NodeQueue(Node):
+    """A queued edge: the received data is queued and handed to 'node' later in the main
+    loop, so the Node that sends to it does not wait for a slow receiver, and 'node' and
+    the Nodes after it (e.g. NodeText, the callbacks of a NodeSeqCheck) run in the main
+    loop like the other Nodes.
+    At most 'capacity' bytes are queued, when more arrive 'policy' decides:
+    'block':       the data is queued anyway (counted in 'delayed') and the app is throttled
+                   (MTCore.throttle()), so the sources that send to it wait until the
+                   queue was handed on
+    'drop_oldest': the oldest queued data is dropped
+    'drop_newest': the new data is dropped
+    'coalesce':    data from the same sender is joined, so 'node' gets fewer and larger
+                   chunks, and only the newest 'capacity' bytes are kept
+    The counters in 'stats' are in bytes, 'max_depth' is the most bytes ever queued.
+    append_receiver(..., capacity = n, policy = p) puts a NodeQueue in front of the receivers.
+    """
+    POLICIES = ('block', 'drop_oldest', 'drop_newest', 'coalesce')
+
+    def __init__(self, app, node, uid = '', capacity = 1 << 20, policy = 'block'):
+        if not policy in self.POLICIES:
+            raise MTException("unknown queue policy '%s'" % (policy))
+        Node.__init__(self, app, uid)
+        self.node = node
+        self.capacity = max(capacity, 1)
+        self.policy = policy
+        self.q = collections.deque()    # [data, caller]
+        self.qn = 0     # number of bytes in q
+        self.lock = threading.Lock()
+        self.stats = {'in': 0, 'out': 0, 'dropped': 0, 'delayed': 0, 'max_depth': 0}
+        self.sched = False  # flush() was requested and did not run yet
+        self.full = False   # the app is throttled by this queue
+        app.register_close(self)
+
+    def recv(self, ba, caller):
+        n = len(ba)
+        if n == 0:
+            return
+        full = False
+        with self.lock:
+            st = self.stats
+            st['in'] += n
+            if self.qn + n > self.capacity:
+                if self.policy == 'drop_newest':
+                    st['dropped'] += n
+                    return
+                if self.policy == 'block':
+                    st['delayed'] += n
+                    full = not self.full
+                    self.full = True
+                elif self.policy == 'drop_oldest':
+                    while len(self.q) != 0 and self.qn + n > self.capacity:
+                        self.qn -= len(self.q[0][0])
+                        st['dropped'] += len(self.q.popleft()[0])
+            if self.policy == 'coalesce':
+                if len(self.q) != 0 and self.q[-1][1] == caller:
+                    self.q[-1][0].extend(ba)
+                else:
+                    self.q.append([bytearray(ba), caller])
+                self.qn += n
+                while self.qn > self.capacity:
+                    cut = min(self.qn - self.capacity, len(self.q[0][0]))
+                    del self.q[0][0][:cut]
+                    if len(self.q[0][0]) == 0:
+                        self.q.popleft()
+                    self.qn -= cut
+                    st['dropped'] += cut
+            else:
+                self.q.append([bytes(ba), caller])
+                self.qn += n
+            if self.qn > st['max_depth']:
+                st['max_depth'] = self.qn
+            sched = not self.sched
+            self.sched = True
+        if full:
+            self.app.throttle(self, True)
+        if sched:
+            self.app.call_later(0, self.flush)
+
+    def flush(self):
+        """Called in the main loop, hand the queued data to 'node'.
+        """
+        with self.lock:
+            lst = self.q
+            self.q = collections.deque()
+            self.qn = 0
+            self.sched = False
+            full = self.full
+            self.full = False
+        n = 0
+        try:
+            for ba, caller in lst:
+                self.node.recv(ba, caller)
+                n += len(ba)
+        finally:
+            with self.lock:
+                self.stats['out'] += n
+            if full:
+                self.app.throttle(self, False)
+
+    def depth(self):
+        return self.qn
+
+    def close(self):
+        """Hand the queued data to the receiver.
+        """
+        self.flush()
+
+
+def singleton(class_):
+    instances = {}
+    def getinstance(*args, **kwargs):
+        if class_ not in instances:
+            instances[class_] = class_(*args, **kwargs)
+        return instances[class_]
+    return getinstance
+
+
+@singleton
+class NodeKeyboard(Node):
+    """Send the keyboard input data to the registered receivers.
+    It seems problematic to get the real characters, e.g. Shift-+ does not give *.
+    """
+    def __init__(self, app, uid = ''):
+        Node.__init__(self, app, uid)
+        self.app = app
+        app.register_keylistener(self)
+
+    def recv(self, ba, caller = ''):
+        if len(ba) != 0:
+            self.emit(ba)
+
+
+class BufferPool(object):
+    """Preallocated bytearrays of 'size' bytes for the reads of a source, so a long session
+    at a high baud rate does not allocate a new object for each read.  At most 'count'
+    buffers are kept, when the pool is empty a new one is allocated and counted in 'misses'.
+    get() and put() may be called from different threads.
+    A buffer that is still exported when it is put back (a receiver kept a view of the
+    data instead of copying it) is not reused, so the view does not change under the
+    receiver, it is counted in 'kept'.
+    """
+    def __init__(self, count = 16, size = 4096):
+        self.count = count
+        self.size = size
+        self.free = collections.deque(bytearray(size) for i in range(count))
+        self.misses = 0
+        self.kept = 0
+
+    def get(self):
+        try:
+            return self.free.popleft()
+        except IndexError:
+            self.misses += 1
+            return bytearray(self.size)
+
+    def put(self, buf):
+        try:
+            buf.append(0)   # a bytearray with exports can not be resized
+        except BufferError:
+            self.kept += 1
+            return
+        del buf[-1]
+        if len(self.free) < self.count:
+            self.free.append(buf)
+
+
+class NodeSource(Node):
+    """Base class for Nodes that read data in a ProcHandler thread.  The data given to
+    push() is buffered and handed to the receivers in the main loop, all data that arrived
+    in the meantime is given to each receiver with a single call.
+    The data is delivered at the latest 'latency' seconds after it arrived or as soon as
+    'max_batch' bytes are waiting.  If more than 'max_pending' bytes are waiting (the
+    main loop does not keep up), new data is dropped and counted in 'dropped'.
+    The buffer has one producer (push()) and one consumer (drain()) and needs no lock:
+    the producer only changes 'rin', the consumer only 'rout'.
+    """
+    def __init__(self, app, uid = '', latency = 0.01, max_batch = 65536, max_pending = 1 << 20):
+        Node.__init__(self, app, uid)
+        self.latency = latency
+        self.max_batch = max_batch
+        self.max_pending = max_pending
+        self.rq = collections.deque()   # received chunks waiting for delivery
+        self.rin = 0    # number of bytes pushed
+        self.rout = 0   # number of bytes delivered
+        self.rt = 0     # time when rq became non-empty
+        self.dropped = 0
+
+    @property
+    def rn(self):
+        """The number of bytes waiting for delivery.
+        """
+        return self.rin - self.rout
+
+    def push(self, ba):
+        """Buffer received data for delivery in the main loop.
+        """
+        n = len(ba)
+        pending = self.rin - self.rout
+        if pending != 0 and pending + n > self.max_pending:
+            self.dropped += n
+            return
+        if pending == 0:
+            self.rt = time.monotonic()
+        self.rq.append(ba)
+        self.rin += n   # after the append, so drain() finds the chunk
+
+    def due(self, now):
+        """Return None if no data is waiting, else the seconds until it is due.
+        """
+        pending = self.rin - self.rout
+        if pending == 0:
+            return None
+        if pending >= self.max_batch:
+            return 0
+        return self.rt + self.latency - now
+
+    def drain(self):
+        """Called in the main loop, hand the buffered data to the receivers.
+        At most 'max_batch' bytes (but at least one chunk) are handed over per call.
+        """
+        avail = self.rin - self.rout
+        if avail == 0:
+            return
+        lst = []
+        n = 0
+        while n < avail and (n == 0 or n + len(self.rq[0]) <= self.max_batch):
+            ba = self.rq.popleft()
+            lst.append(ba)
+            n += len(ba)
+        self.rout += n
+        if self.rin != self.rout:
+            self.rt = time.monotonic()
+        ba = memoryview(lst[0] if len(lst) == 1 else b''.join(lst)).toreadonly()
+        self.emit(ba)
+        try:
+            ba.release()
+        except BufferError:
+            pass    # a receiver made a view of it, see BufferPool
+        self.recycle(lst)
+
+    def recycle(self, lst):
+        """Called after the chunks in lst were delivered, the buffers they are in may be
+        reused unless a receiver still has a view of them.
+        """
+        pass
+
+
+class NodeSerial(NodeSource):
+    """The input and output from a serial line is handled by this Node.
+    Once registered at a ProcHandler of the app (the shared one or, with
+    nodeSerial(thread = True), one of its own), data is only read when the serial line
+    signals that bytes arrived.  Data to be written is queued and written by the
+    ProcHandler, so the caller of recv() never blocks on the serial line.
+    The received data is delivered in the main loop as described in NodeSource.
+    The data is read into the buffers of a BufferPool ('pool' buffers of 'chunk' bytes,
+    pool = 0 reads new bytes objects): reads go into the free end of the current buffer,
+    the receivers get memoryviews of it and it is reused once all of its data was
+    delivered.  Lines with a file descriptor are read directly with os.readv(), others
+    with ser.readinto() (where available) of at most in_waiting bytes.
+    'ser' can also be the name of a port, it is then opened with open_serial().
+    When the line fails (an OSError, or the end of file when it was unplugged), it is no
+    longer read, data given to recv() is dropped and the error is kept in 'error' and
+    reported with MTCore.report_error().
+    """
+    def __init__(self, app, ser, uid = '', latency = 0.01, max_batch = 65536, max_pending = 1 << 20,
+                 pool = 16, chunk = 4096):
+        NodeSource.__init__(self, app, uid, latency, max_batch, max_pending)
+        self.app = app
+        self.ser = open_serial(ser) if isinstance(ser, str) else ser
+        self.thr = None # the ProcHandler that handles this Node
+        self.wq = collections.deque()   # chunks waiting to be written, filled by recv()
+        self.wrest = b''    # the part of the last write the line did not take
+        self.pool = BufferPool(pool, chunk) if pool > 0 else None
+        self.buf = None     # the buffer read into
+        self.off = 0        # the start of its free end
+        self.last = None    # the buffer of the last chunk delivered
+        self.fd = -1
+        self.error = None   # the exception that ended the line
+
+    def attach(self, thr):
+        self.thr = thr
+        self.fd = self.fileno()
+        if self.fd >= 0 and hasattr(self.ser, 'write_timeout'):
+            # only written when the line is writable, never block in write()
+            self.ser.write_timeout = 0
+
+    def fileno(self):
+        try:
+            return self.ser.fileno()
+        except Exception:
+            return -1
+
+    def recv(self, ba, caller = ''):
+        if not self.error is None:
+            return
+        self.wq.append(bytes(ba))
+        if not self.thr is None:
+            self.thr.wakeup()
+
+    def failed(self, e):
+        self.error = e
+        self.wq.clear()
+        self.wrest = b''
+
+    def write_pending(self):
+        return len(self.wq) != 0 or len(self.wrest) != 0
+
+    def write_ready(self):
+        lst = [self.wrest] if len(self.wrest) != 0 else []
+        while len(self.wq) != 0:
+            lst.append(self.wq.popleft())
+        ba = lst[0] if len(lst) == 1 else b''.join(lst)
+        if len(ba) != 0:
+            n = self.ser.write(ba)
+            # keep what the line did not take in front of the queue
+            self.wrest = b'' if n is None or n >= len(ba) else ba[n:]
+
+    def proc(self):
+        if self.pool is None:
+            n = getattr(self.ser, 'in_waiting', 0)
+            ba = self.ser.read(max(n, 1))
+            if len(ba) != 0:
+                self.push(ba)
+            return
+        if self.buf is None or self.pool.size - self.off < self.pool.size // 8:
+            self.buf = self.pool.get()
+            self.off = 0
+        mv = memoryview(self.buf)[self.off:]
+        if self.fd >= 0:
+            try:
+                n = os.readv(self.fd, [mv])
+            except (BlockingIOError, InterruptedError):
+                return
+            if n == 0:
+                # readable without data: the end of file, the line is gone
+                raise MTException("serial line %s was closed" % (self.app.node_name(self)))
+        else:
+            n = max(getattr(self.ser, 'in_waiting', 0), 1)
+            if hasattr(self.ser, 'readinto'):
+                n = self.ser.readinto(mv[:n]) or 0
+            else:
+                ba = self.ser.read(min(n, len(mv)))
+                n = len(ba)
+                mv[:n] = ba
+        if n > 0:
+            self.push(mv[:n])
+            self.off += n
+
+    def recycle(self, lst):
+        if self.pool is None:
+            return
+        # the chunks come in the order they were read, once a chunk is in another buffer
+        # the reads into the previous one are done
+        bufs = [getattr(mv, 'obj', None) for mv in lst]
+        for mv in lst:
+            try:
+                mv.release()    # our views of the buffers, only the ones of receivers remain
+            except BufferError:
+                pass
+        lst.clear()
+        for buf in bufs:
+            if buf is self.last:
+                continue
+            if not self.last is None:
+                self.pool.put(self.last)
+            self.last = buf
+
+
+class NodeReplay(NodeSource):
+    """Replay a file written by NodeLogfile, e.g. to test a graph of Nodes with recorded data.
+    Plain files are memory mapped, the receivers get memoryview slices of at most 'chunk'
+    bytes of it, so also huge files are not loaded into memory.  Files compressed with
+    gzip, bz2 or lzma are decompressed while they are replayed.
+    The format is told by the start of the file unless 'fmt' is given: files in the formats
+    'bin' (see LOGMAGIC) and 'text' are replayed record by record, paced by the recorded
+    times: speed 1.0 is the original timing, 10.0 ten times as fast.  Speed 0 and files in
+    the format 'raw' are replayed as fast as possible.  A file that cannot be replayed (an
+    unknown format, a record of 'text' that does not parse) raises an MTException.
+    When registered with MultiTerm.register_proc() (nodeReplay() does that), the data is
+    delivered in the main loop like the data of a NodeSerial, play() replays the whole file
+    directly in the calling thread.
+    """
+    def __init__(self, app, fname, uid = '', chunk = 4096, speed = 0, max_pending = 1 << 20, fmt = None):
+        NodeSource.__init__(self, app, uid, 0, chunk, max_pending)
+        if not fmt in (None, 'raw', 'text', 'bin'):
+            raise MTException("NodeReplay: unknown format '%s'" % (fmt))
+        self.fname = fname
+        self.chunk = chunk
+        self.speed = speed
+        self.fd = open(fname, "rb")
+        head = self.fd.read(8)
+        self.compress = next((c for m, c in COMPRESSED if head.startswith(m)), None)
+        if not self.compress is None:
+            self.fd.close()
+            self.fd = self.open_compressed()
+            head = self.fd.peek(64)[:64]
+        else:
+            head = head + self.fd.read(56)
+        if fmt is None:
+            if head.startswith(LOGMAGIC[:5]):
+                fmt = 'bin'
+            elif not LOGTEXT.match(head) is None:
+                fmt = 'text'
+            else:
+                fmt = 'raw'
+        if fmt == 'bin' and not head.startswith(LOGMAGIC):
+            self.fd.close()
+            raise MTException("NodeReplay: %s is not a log of the format 'bin' of this version" % (fname))
+        self.fmt = fmt
+        self.mm = None
+        self.mv = None  # the memory mapped file, None when it is read as a stream
+        if self.compress is None:
+            if fmt != 'text' and os.fstat(self.fd.fileno()).st_size != 0:
+                self.mm = mmap.mmap(self.fd.fileno(), 0, access = mmap.ACCESS_READ)
+                self.mv = memoryview(self.mm)
+            else:
+                self.fd.seek(0)
+        self.it = self.chunks()
+        self.nxt = next(self.it, None)  # the next (time, data) to hand out
+        self.t0 = None  # time when the replay started
+        self.r0 = None  # recorded time of the first record
+        app.register_close(self)
+
+    def open_compressed(self):
+        if self.compress == 'gzip':
+            import gzip
+            return gzip.open(self.fname, "rb")
+        elif self.compress == 'bz2':
+            import bz2
+            return bz2.open(self.fname, "rb")
+        import lzma
+        return lzma.open(self.fname, "rb")
+
+    def reader(self):
+        """Return read(n), which returns the next n bytes of the file (less at its end).
+        """
+        if self.mv is None:
+            return self.fd.read
+        mv = self.mv
+        pos = [0]
+        def read(n):
+            ba = mv[pos[0]:pos[0]+n]
+            pos[0] += len(ba)
+            return ba
+        return read
+
+    def chunks(self):
+        if self.fmt == 'text':
+            yield from self.lines()
+            return
+        read = self.reader()
+        if self.fmt == 'raw':
+            while True:
+                ba = read(self.chunk)
+                if len(ba) == 0:
+                    return
+                yield None, ba
+        read(len(LOGMAGIC))
+        while True:
+            hdr = read(LOGREC.size)
+            if len(hdr) < LOGREC.size:
+                return
+            t, ul, dl = LOGREC.unpack(hdr)
+            read(ul)
+            ba = memoryview(read(dl))
+            for i in range(0, len(ba), self.chunk):
+                yield t, ba[i:i+self.chunk]
+
+    def lines(self):
+        for n, line in enumerate(self.fd, 1):
+            f = line.rstrip(b'\n').split(b' ', 2)
+            try:
+                t = float(f[0])
+                f[1].decode('unicode_escape')   # the UID, it is not replayed
+                ba = memoryview(f[2].decode('unicode_escape').encode('latin-1'))
+            except (IndexError, ValueError, UnicodeError):
+                raise MTException("NodeReplay: %s line %i is not a record of the format 'text'" % (self.fname, n))
+            for i in range(0, len(ba), self.chunk):
+                yield t, ba[i:i+self.chunk]
+
+    def wait(self, t, now):
+        """Return the seconds until the data recorded at time t is due.
+        """
+        if self.speed <= 0 or t is None:
+            return 0
+        if self.t0 is None:
+            self.t0 = now
+            self.r0 = t
+        return self.t0 + (t - self.r0) / self.speed - now
+
+    def done(self):
+        return self.nxt is None
+
+    def proc(self):
+        now = time.monotonic()
+        while not self.nxt is None and self.rn < self.max_pending:
+            t, ba = self.nxt
+            if self.wait(t, now) > 0:
+                break
+            self.push(ba)
+            self.nxt = next(self.it, None)
+
+    def play(self):
+        """Hand the rest of the file to the receivers in the calling thread.
+        """
+        while not self.nxt is None:
+            t, ba = self.nxt
+            dt = self.wait(t, time.monotonic())
+            if dt > 0:
+                time.sleep(dt)
+            self.emit(ba)
+            self.nxt = next(self.it, None)
+
+    def close(self):
+        self.nxt = None
+        self.it = iter(())
+        if not self.mv is None:
+            self.mv.release()
+        if not self.mm is None:
+            try:
+                self.mm.close()
+            except BufferError:
+                pass    # a receiver still holds a slice
+        self.fd.close()
+
+
+class NodeText(Node):
+    """Instances of these Nodes get a color parameter.  The input is colored by that color
+    and displayed in the text panel.  The text is queued by the app and shown a limited
+    number of times per second, see MultiTerm.setRender().
+    """
+    def __init__(self, app, col, uid = ''):
+        Node.__init__(self, app, uid)
+        self.app = app
+        self.col = col
+
+    def recv(self, ba, caller):
+        self.app.render(self.col, ba)
+
+
+class NodeStdout(Node):
+    """Write any received data to stdout (or to the binary file object 'out').
+    """
+    def __init__(self, app, uid = '', out = None):
+        Node.__init__(self, app, uid)
+        self.out = sys.stdout.buffer if out is None else out
+
+    def recv(self, ba, caller):
+        self.out.write(ba)
+        self.out.flush()
+
+
+def open_serial(port, baudrate = 9600, **kwds):
+    """Open a serial line with pySerial, which is only imported now, with timeout = 0 as
+    NodeSerial needs it.
+    """
+    import serial
+    return serial.Serial(port, baudrate, timeout = 0, **kwds)
+
+
+def cachedir():
+    return os.path.join(os.environ.get('XDG_CACHE_HOME') or os.path.expanduser("~/.cache"), "multiterm")
+
+
+def load_mod(path, cache = True):
+    """Load the Python file 'path' as a module, e.g. a configuration that defines init(app).
+    The compiled code is kept in cachedir() (unless Python does not write bytecode, -B) and
+    only compiled again when the size or the modification time of the file changed or
+    another Python version loads it.
+    """
+    import zlib
+    import types
+    import marshal
+    path = os.path.abspath(path)
+    st = os.stat(path)
+    key = (sys.hexversion, path, st.st_size, st.st_mtime_ns)
+    cpath = os.path.join(cachedir(), "%s-%08x.code" % (os.path.basename(path), zlib.crc32(path.encode())))
+    code = None
+    if cache:
+        try:
+            with open(cpath, "rb") as f:
+                k, code = marshal.loads(f.read())
+            if k != key:
+                code = None
+        except (OSError, EOFError, ValueError, TypeError):
+            code = None
+    if code is None:
+        with open(path, "rb") as f:
+            code = compile(f.read(), path, 'exec')
+        if cache and not sys.dont_write_bytecode:
+            try:
+                os.makedirs(cachedir(), exist_ok = True)
+                tmp = "%s.%i" % (cpath, os.getpid())
+                with open(tmp, "wb") as f:
+                    f.write(marshal.dumps((key, code)))
+                os.replace(tmp, cpath)
+            except OSError:
+                pass
+    mod = types.ModuleType(os.path.splitext(os.path.basename(path))[0])
+    mod.__file__ = path
+    exec(code, mod.__dict__)
+    return mod
+
+
+def configdir():
+    return os.path.expanduser("~")
+
+
+def configfile():
+    return configdir() + "/.multiterm.dta"
+
+
+class Settings(dict):
+    """Save / Load settings data, also handle default data for them.
+    """
+    def __init__(self):
+        super(Settings, self).__init__(self)
+        self.__dict__ = self
+        self.x = 10
+        self.y = 10
+        self.w = 1024
+        self.h = 768
+        pth = configfile()
+        if os.path.isfile(pth):
+            self.load()
+
+    def save(self):
+        import zlib
+        import pickle
+        d = pickle.dumps(self.__dict__)
+        dz = zlib.compress(d)
+        pth = configfile()
+        f = open(pth, "wb")
+        f.write(dz)
+        f.close()
+
+    def load(self):
+        import zlib
+        import pickle
+        pth = configfile()
+        f = open(pth, "rb")
+        dz = f.read()
+        f.close()
+        d = zlib.decompress(dz)
+        q = pickle.loads(d)
+        for k in q.keys():
+            self.__dict__[k] = q[k]
+
+    def show(self):
+        print(self.__dict__)
+
+
+class Scrollback(object):
+    """The lines shown in the text panel, each line is a list of (color, bytes) segments.
+    A line ends at LF, CR or CRLF.  At most 'max_lines' lines and 'max_bytes' bytes are
+    kept (0 means no limit), older lines are removed.  If 'spill' is a file name, the
+    removed lines are appended to that file and can be read back with history().
+    """
+    def __init__(self, max_lines = 100000, max_bytes = 0, spill = None):
+        self.lines = collections.deque()    # complete lines, tuples of (color, bytes)
+        self.cur = []   # the line that is not yet complete, lists of [color, bytearray]
+        self.nbytes = 0 # number of bytes in self.lines
+        self.dropped = 0    # number of lines removed so far
+        self.cr = False # the last byte appended was a CR
+        self.fd = None
+        self.configure(max_lines, max_bytes, spill)
+
+    def configure(self, max_lines, max_bytes = 0, spill = None):
+        self.max_lines = max_lines
+        self.max_bytes = max_bytes
+        if not self.fd is None:
+            self.fd.close()
+            self.fd = None
+        self.spill = spill
+        if not spill is None:
+            self.fd = open(spill, "ab")
+        self.trim()
+
+    def __len__(self):
+        return len(self.lines) + 1
+
+    def line(self, n):
+        """Return the segments of line n, the last line is the one not yet complete.
+        """
+        if n < len(self.lines):
+            return self.lines[n]
+        return self.cur
+
+    def add(self, col, ba):
+        if len(ba) == 0:
+            return
+        if len(self.cur) != 0 and self.cur[-1][0] == col:
+            self.cur[-1][1] += ba
+        else:
+            self.cur.append([col, bytearray(ba)])
+
+    def newline(self):
+        ln = tuple((col, bytes(ba)) for col, ba in self.cur)
+        self.lines.append(ln)
+        self.nbytes += sum(len(ba) for col, ba in ln)
+        self.cur = []
+
+    def append(self, col, ba):
+        """Append the bytes ba in color col, return the number of lines that were removed.
+        """
+        if self.cr and ba[:1] == b'\n':
+            ba = ba[1:]
+        if len(ba) == 0:
+            return 0
+        self.cr = ba[-1:] == b'\r'
+        if ba.find(b'\r') >= 0:
+            ba = ba.replace(b'\r\n', b'\n').replace(b'\r', b'\n')
+        parts = ba.split(b'\n')
+        self.add(col, parts[0])
+        for part in parts[1:]:
+            self.newline()
+            self.add(col, part)
+        return self.trim()
+
+    def trim(self):
+        n = 0
+        while len(self.lines) != 0 and ((self.max_lines != 0 and len(self.lines) >= self.max_lines) or
+                (self.max_bytes != 0 and self.nbytes > self.max_bytes)):
+            ln = self.lines.popleft()
+            self.nbytes -= sum(len(ba) for col, ba in ln)
+            if not self.fd is None:
+                self.fd.write(b''.join(ba for col, ba in ln) + b'\n')
+            n += 1
+        self.dropped += n
+        return n
+
+    def history(self, count):
+        """Return the last 'count' removed lines as bytes, read back from the spill file.
+        """
+        if self.fd is None or count <= 0:
+            return []
+        self.fd.flush()
+        with open(self.spill, "rb") as f:
+            end = f.seek(0, 2)
+            sz = 4096
+            while True:
+                start = max(0, end - sz)
+                f.seek(start)
+                dta = f.read(end - start)
+                if start == 0 or dta.count(b'\n') > count:
+                    break
+                sz *= 2
+        lines = dta.split(b'\n')[:-1]
+        if start != 0:
+            lines = lines[1:]
+        return lines[-count:]
+
+    def close(self):
+        if not self.fd is None:
+            self.fd.close()
+            self.fd = None
+
+
+def stats_text(snap, prev = None):
+    """Return a line for a status bar from snapshot()s: the receive rate of each source
+    (with a previous snapshot), the depths of the queues and what was dropped.
+    """
+    dt = snap['time'] - prev['time'] if not prev is None else 0
+    lst = []
+    for name, d in snap['nodes'].items():
+        txt = ''
+        if 'read' in d and dt > 0 and name in prev['nodes']:
+            txt += ' %.1f kB/s' % ((d['read'] - prev['nodes'][name].get('read', 0)) / dt / 1000)
+        if d.get('pending', 0) != 0:
+            txt += ' pending %i' % (d['pending'])
+        if d.get('depth', 0) != 0:
+            txt += ' queue %i' % (d['depth'])
+        dropped = d.get('dropped', 0) + d.get('queue', {}).get('dropped', 0)
+        if dropped != 0:
+            txt += ' dropped %i' % (dropped)
+        if txt != '':
+            lst.append(name + ':' + txt)
+    return '  '.join(lst)
+
+
+def make_emit(pairs):
+    """Return a function that calls f(ba, u) for each (f, u) in pairs.
+    """
+    if len(pairs) == 0:
+        def emit(ba, caller = None):
+            pass
+    elif len(pairs) == 1:
+        f, u = pairs[0]
+        def emit(ba, caller = None):
+            f(ba, u)
+    else:
+        pairs = tuple(pairs)
+        def emit(ba, caller = None):
+            for f, u in pairs:
+                f(ba, u)
+    return emit
+
+
+def make_chain(xfs, f, u):
+    """Return (function, argument) for a fused chain: the functions xfs are applied to the
+    data one after another, then f(ba, u) is called (if f is not None).
+    """
+    if len(xfs) == 0:
+        return f, u
+    if len(xfs) == 1:
+        xf = xfs[0]
+        if f is None:
+            def run(ba, caller = None):
+                xf(ba)
+        else:
+            def run(ba, caller = None):
+                b = xf(ba)
+                if not b is None:
+                    f(b, u)
+        return run, None
+    def run(ba, caller = None):
+        for xf in xfs:
+            ba = xf(ba)
+            if ba is None:
+                return
+        if not f is None:
+            f(ba, u)
+    return run, None
+
+
+class Stats(object):
+    """Counters of calls, bytes and time (ns) with a histogram of the time per call:
+    bucket b counts the calls that took less than 2**b ns.
+    """
+    __slots__ = ('calls', 'bytes', 'ns', 'hist', 'samples')
+
+    def __init__(self):
+        self.calls = 0
+        self.bytes = 0
+        self.ns = 0
+        self.hist = [0] * 64
+        self.samples = 0    # of the sampling profiler
+
+    def add(self, n, dt):
+        self.calls += 1
+        self.bytes += n
+        self.ns += dt
+        self.hist[dt.bit_length()] += 1
+
+    def percentile(self, p):
+        """Return an upper bound of the p-th percentile of the time per call in us.
+        """
+        lim = self.calls * p / 100.0
+        n = 0
+        for b, k in enumerate(self.hist):
+            n += k
+            if n >= lim and n != 0:
+                return (1 << b) / 1000.0
+        return 0
+
+    def dict(self):
+        return {'calls': self.calls, 'bytes': self.bytes, 'ms': self.ns / 1e6,
+                'p50_us': self.percentile(50), 'p99_us': self.percentile(99),
+                'samples': self.samples}
+
+
+class EdgeProbe(object):
+    """Takes the place of a receiver in the list of receivers of a Node and measures the
+    data and time that goes along this edge of the graph.
+    """
+    def __init__(self, ins, src, key, dst):
+        self.ins = ins
+        self.src = src
+        self.key = key
+        self.dst = dst
+        self.uid = dst.uid
+        self.st = Stats()
+
+    def recv(self, ba, *args):
+        stacks = self.ins.stacks
+        if not stacks is None:
+            stk = stacks.setdefault(threading.get_ident(), [])
+            stk.append(self.st)
+        t = time.perf_counter_ns()
+        self.dst.recv(ba, *args)
+        self.st.add(len(ba), time.perf_counter_ns() - t)
+        if not stacks is None:
+            stk.pop()
+
+
+class Instrument(object):
+    """The probes of MTCore.instrument(): recv() and proc() of the Nodes are replaced by
+    functions that count and time the calls, the receivers in the lists 'ch' of the Nodes
+    by EdgeProbes.  remove() restores everything, so there is no cost when disabled.
+    """
+    def __init__(self, app):
+        self.app = app
+        self.recvs = dict()  # node -> (Stats, recv() of the instance or None)
+        self.procs = dict()  # object -> (Stats, proc() of the instance or None)
+        self.stacks = None  # thread id -> [Stats of the edges], while profiling
+        self.prof = None
+        self.t0 = time.monotonic()
+
+    def wrap(self, ob, name, tab):
+        if ob in tab or not hasattr(ob, name):
+            return
+        st = Stats()
+        fn = getattr(ob, name)
+        clock = time.perf_counter_ns
+        if name == 'recv':
+            def probe(ba, *args):
+                t = clock()
+                fn(ba, *args)
+                st.add(len(ba), clock() - t)
+        else:
+            def probe(*args):
+                t = clock()
+                fn(*args)
+                st.add(0, clock() - t)
+        tab[ob] = (st, ob.__dict__.get(name))
+        setattr(ob, name, probe)
+
+    def node(self, nd):
+        """Install the probes of a Node and of the edges to its receivers.
+        """
+        self.wrap(nd, 'recv', self.recvs)
+        for k, lst in nd.ch.items():
+            for i, c in enumerate(lst):
+                if not isinstance(c, EdgeProbe):
+                    lst[i] = EdgeProbe(self, nd, k, c)
+                    self.wrap(c, 'recv', self.recvs)
+        if nd in self.app.proc:
+            self.wrap(nd, 'proc', self.procs)
+
+    def install(self):
+        for nd in list(self.app.nodes):
+            self.node(nd)
+        for ob in self.app.proc:
+            self.wrap(ob, 'proc', self.procs)
+
+    def remove(self):
+        self.profile(0)
+        for tab, name in ((self.recvs, 'recv'), (self.procs, 'proc')):
+            for ob, (st, orig) in tab.items():
+                if orig is None:
+                    del ob.__dict__[name]
+                else:
+                    setattr(ob, name, orig)
+        for nd in list(self.app.nodes):
+            for lst in nd.ch.values():
+                for i, c in enumerate(lst):
+                    if isinstance(c, EdgeProbe):
+                        lst[i] = c.dst
+        self.recvs = dict()
+        self.procs = dict()
+
+    def profile(self, interval):
+        """Sample every 'interval' seconds which edge each thread is in (0 stops).
+        """
+        if not self.prof is None:
+            self.prof, thr = None, self.prof
+            thr.join()
+        if interval <= 0:
+            self.stacks = None
+            return
+        self.stacks = dict()
+        def run():
+            while self.prof is threading.current_thread():
+                for stk in list(self.stacks.values()):
+                    try:
+                        stk[-1].samples += 1
+                    except IndexError:
+                        pass
+                time.sleep(interval)
+        self.prof = threading.Thread(target = run, daemon = True)
+        self.prof.start()
+
+    def out_ns(self, nd):
+        return sum(c.st.ns for lst in nd.ch.values() for c in lst if isinstance(c, EdgeProbe))
+
+    def snapshot(self):
+        nodes = dict()
+        edges = dict()
+        for nd in list(self.app.nodes):
+            d = self.app.node_info(nd)
+            if nd in self.recvs:
+                st = self.recvs[nd][0]
+                d.update(st.dict())
+                d['self_ms'] = (st.ns - self.out_ns(nd)) / 1e6
+            if nd in self.procs:
+                d['proc'] = self.procs[nd][0].dict()
+            out = 0
+            for lst in nd.ch.values():
+                for c in lst:
+                    if isinstance(c, EdgeProbe):
+                        out += c.st.bytes
+                        k = '' if c.key == '_' else '[%s]' % (c.key)
+                        edges['%s -%s> %s' % (self.app.node_name(nd), k, self.app.node_name(c.dst))] = c.st.dict()
+            d['bytes_out'] = out
+            nodes[self.app.node_name(nd)] = d
+        return nodes, edges
+
+
+class MTCore(object):
+    """The part of the app that does not depend on a GUI.  It holds the ProcHandlers and the
+    registered objects and creates the Nodes.  Derived classes implement post(), render(),
+    call_later() and quit() for their main loop and call start_threads() when it starts.
+    A derived class that handles the objects itself passes that handler as 'thr', else a
+    ProcHandler is created.
+    """
+    def __init__(self, thr = None):
+        self.proc = []
+        self.closers = []
+        self.posted = False # post() was called, deliver() did not run yet
+        self.plock = threading.Lock()
+        self.thr = ProcHandler(self) if thr is None else thr    # shared by all objects without a thread of their own
+        self.handlers = []  # the ProcHandlers of the objects registered with thread = True
+        self.pool = 0       # number of ProcHandlers for these, 0: one for each
+        self.started = False
+        self.kl = None
+        self.nodes = weakref.WeakKeyDictionary()    # Node -> name in snapshot(), see register_node()
+        self.used = set()   # the names given so far
+        self.instr = None   # the Instrument while instrument() is on
+        self.compiled = False
+        self.deps = weakref.WeakKeyDictionary()     # Node -> the Nodes whose compiled emit() includes it
+        self.on_error = None    # on_error(ob, exception), see report_error()
+        self.congested = set()  # Nodes that cannot take more data for now, see throttle()
+        self.held = frozenset() # the sources whose data reaches one of them
+
+    def post(self):
+        """To be implemented in the derived class: make the main loop call deliver().
+        """
+        pass
+
+    def render(self, col, ba):
+        """To be implemented in the derived class: show the text of a NodeText.
+        """
+        pass
+
+    def call_later(self, sec, fn):
+        """To be implemented in the derived class: call fn() in the main loop after sec
+        seconds, may be called from any thread.
+        """
+        pass
+
+    def quit(self):
+        """To be implemented in the derived class: end the main loop.
+        """
+        pass
+
+    def report_error(self, ob, e):
+        """Report an exception of ob (e.g. a serial line that was unplugged), may be called
+        from any thread.  In the main loop on_error(ob, e) is called if it is set, else the
+        error is printed on stderr.
+        """
+        self.call_later(0, lambda: self.show_error(ob, e))
+
+    def show_error(self, ob, e):
+        if not self.on_error is None:
+            self.on_error(ob, e)
+        else:
+            name = self.node_name(ob) if isinstance(ob, Node) else type(ob).__name__
+            sys.stderr.write("%s: %s: %s\n" % (name, type(e).__name__, e))
+
+    def post_serial(self):
+        """Called from the ProcHandler when received data is due, make the main loop
+        call deliver().  Only one request is on its way at any time.
+        """
+        with self.plock:
+            if self.posted:
+                return
+            self.posted = True
+        self.post()
+
+    def deliver(self):
+        """Called in the main loop, hand the received data to the receivers.
+        """
+        self.posted = False
+        pending = False
+        held = self.held
+        for ob in self.proc:
+            if hasattr(ob, 'drain') and not ob in held:
+                ob.drain()
+                pending = pending or ob.rn != 0
+        if pending:
+            self.thr.wakeup()
+            for h in self.handlers:
+                h.wakeup()
+
+    def throttle(self, node, full):
+        """Called in the main loop by a Node that cannot take more data for now (full =
+        True) and once it can again.  While a Node is full, the data of the sources it
+        would reach is not delivered, these sources buffer it up to their max_pending.  The
+        other sources go on, e.g. the output of a NodeProcess whose input is full.
+        """
+        if full:
+            self.congested.add(node)
+        else:
+            self.congested.discard(node)
+        self.held = frozenset(ob for ob in self.proc if hasattr(ob, 'drain') and
+                              any(not self.reaches(c, n) is None for c in self.targets(ob) for n in self.congested))
+        if not full:
+            self.post_serial()
+
+    def register_keylistener(self, kl):
+        self.kl = kl
+
+    def register_node(self, nd):
+        """Called by each Node when it is created.  The Nodes are only referenced weakly, a
+        Node that is no longer used is not kept for snapshot() and compile().
+        """
+        name = nd.uid if isinstance(nd.uid, str) and nd.uid != '' else type(nd).__name__
+        if name in self.used:
+            name = '%s#%i' % (name, len(self.used))
+        self.used.add(name)
+        self.nodes[nd] = name
+
+    def node_name(self, nd):
+        return self.nodes.get(nd, type(nd).__name__)
+
+    def node_info(self, nd):
+        """Return the counters a Node keeps anyway, e.g. the bytes read and the queue depth.
+        """
+        d = {'class': type(nd).__name__}
+        if isinstance(nd, NodeSource):
+            d['read'] = nd.rin
+            d['pending'] = nd.rn
+            d['dropped'] = nd.dropped
+        if isinstance(nd, NodeSerial):
+            d['write_pending'] = sum(len(b) for b in list(nd.wq)) + len(nd.wrest)
+            if not nd.error is None:
+                d['error'] = str(nd.error)
+        if isinstance(nd, NodeQueue):
+            d['depth'] = nd.qn
+            d['queue'] = dict(nd.stats)
+        if isinstance(nd, NodeLogfile):
+            d['depth'] = nd.qn
+            d['dropped'] = nd.dropped
+            if not nd.error is None:
+                d['error'] = str(nd.error)
+        return d
+
+    def targets(self, nd):
+        """Return the Nodes that nd hands data to.
+        """
+        ret = []
+        for lst in list(nd.ch.values()) + [getattr(nd, 'pch', [])]:
+            for c in lst:
+                ret.append(c.dst if isinstance(c, EdgeProbe) else c)
+        if isinstance(nd, NodeQueue):
+            ret.append(nd.node)
+        return ret
+
+    def reaches(self, src, dst):
+        """Return the path of Nodes from src to dst as a list, or None.  A NodeSource ends a
+        path, its recv() (e.g. writing to a serial line) does not hand the data on.
+        """
+        src = edge_dst(src)
+        if src is dst:
+            return [src]
+        if isinstance(src, NodeSource):
+            return None
+        path = [src]
+        its = [iter(self.targets(src))]
+        seen = set(path)
+        while len(its) != 0:
+            nxt = next(its[-1], None)
+            if nxt is None:
+                path.pop()
+                its.pop()
+            elif nxt is dst:
+                return path + [nxt]
+            elif not nxt in seen and not isinstance(nxt, NodeSource):
+                seen.add(nxt)
+                path.append(nxt)
+                its.append(iter(self.targets(nxt)))
+        return None
+
+    def check_graph(self):
+        """Raise an MTException if the graph of Nodes has a cycle.  Return the Nodes that no
+        data from a source can reach, they may still get data by calls of their recv(), e.g.
+        from a NodeFunc or the 'wire' of a NodeXferLink.
+        """
+        nodes = list(self.nodes)
+        succ = dict((nd, self.targets(nd)) for nd in nodes)
+        state = dict()  # 1: on the current path, 2: done
+        for root in nodes:
+            if root in state:
+                continue
+            path = [root]
+            its = [iter(succ[root])]
+            state[root] = 1
+            while len(its) != 0:
+                nxt = next(its[-1], None)
+                if nxt is None:
+                    state[path.pop()] = 2
+                    its.pop()
+                elif isinstance(nxt, NodeSource) or not nxt in succ:
+                    continue
+                elif state.get(nxt) == 1:
+                    cyc = path[path.index(nxt):] + [nxt]
+                    raise MTException("the graph of Nodes has a cycle: " +
+                                      " -> ".join(self.node_name(n) for n in cyc))
+                elif not nxt in state:
+                    state[nxt] = 1
+                    path.append(nxt)
+                    its.append(iter(succ[nxt]))
+        todo = [nd for nd in nodes if isinstance(nd, NodeSource) or nd is self.kl or nd in self.proc]
+        seen = set(todo)
+        while len(todo) != 0:
+            for n in succ.get(todo.pop(), ()):
+                if not n in seen:
+                    seen.add(n)
+                    todo.append(n)
+        return [nd for nd in nodes if not nd in seen]
+
+    def compile(self):
+        """Check the graph for cycles (see check_graph()) and replace emit() of each Node by a
+        function made for its receivers: their recv() methods are bound beforehand and chains
+        of Nodes that tell how they handle the data (see Node.fuse(), e.g. NodeHex,
+        NodeSelect) are fused into a single function.  Once compiled, a Node whose receivers
+        or routing change is compiled again together with the Nodes whose functions include
+        it (see graph_changed()).
+        """
+        self.check_graph()
+        nodes = list(self.nodes)
+        for nd in nodes:
+            nd.__dict__.pop('emit', None)
+        self.deps = weakref.WeakKeyDictionary()
+        self.install(nodes, None)
+        self.compiled = True
+
+    def install(self, nodes, todo):
+        plans = dict()
+        for nd in nodes:
+            self.plan(nd, plans, todo)
+        for nd, emit in plans.items():
+            nd.emit = emit
+
+    def graph_changed(self, nd = None, edges = ()):
+        """Called when the receivers (the new ones: edges) or the routing of nd changed, or
+        anything if nd is None.  Once compiled, the new edges must not close a cycle and nd
+        is compiled again with the Nodes whose emit() includes it.
+        """
+        if not self.compiled:
+            return
+        if nd is None:
+            self.compile()
+            return
+        for c in edges:
+            path = self.reaches(c, nd)
+            if not path is None:
+                raise MTException("the graph of Nodes has a cycle: " +
+                                  " -> ".join(self.node_name(n) for n in [nd] + path))
+        todo = set([nd])
+        lst = [nd]
+        while len(lst) != 0:
+            for n in self.deps.get(lst.pop(), ()):
+                if not n in todo:
+                    todo.add(n)
+                    lst.append(n)
+        self.install(todo, todo)
+
+    def plan(self, nd, plans, todo):
+        """Return the compiled emit() of nd.  If 'todo' is given, only the Nodes in it get a
+        new one.
+        """
+        if not nd in plans:
+            if not todo is None and not nd in todo and 'emit' in nd.__dict__:
+                return nd.emit
+            pairs = []
+            for c in nd.ch['_']:
+                e = self.entry(c, nd, nd.uid, plans, todo)
+                if e is False:
+                    continue
+                f, u = make_chain(*e)
+                if not f is None:
+                    pairs.append((f, u))
+            plans[nd] = make_emit(pairs)
+        return plans[nd]
+
+    def entry(self, c, owner, caller, plans, todo):
+        """Return (xfs, f, u): c.recv(ba, caller) does the same as applying the functions
+        xfs to ba and calling f(ba, u) with the result (nothing if f is None), or False if
+        it does nothing.  The Nodes asked to be fused into the emit() of 'owner' note it
+        in 'deps'.
+        """
+        cls = next(k for k in type(c).__mro__ if 'recv' in k.__dict__) if isinstance(c, Node) else None
+        if cls is None or not 'fuse' in cls.__dict__ or 'recv' in c.__dict__:
+            return ((), c.recv, caller)
+        how = c.fuse(caller)
+        self.deps.setdefault(c, weakref.WeakSet()).add(owner)
+        if how is None:
+            return ((), c.recv, caller)
+        if how is False:
+            return False
+        xfs = () if how is True else (how,)
+        rest = c.ch['_']
+        if len(rest) == 1:
+            nxt = self.entry(rest[0], owner, c.uid, plans, todo)
+            if nxt is False:
+                return (xfs, None, None)
+            return (xfs + nxt[0], nxt[1], nxt[2])
+        if len(rest) == 0:
+            return (xfs, None, None)
+        return (xfs, self.plan(c, plans, todo), None)
+
+    def instrument(self, on = True):
+        """Count the calls, bytes and time of recv() and proc() of each Node and of each edge
+        of the graph, see snapshot().  Without instrumentation nothing is measured.
+        """
+        if on and self.instr is None:
+            self.instr = Instrument(self)
+            self.instr.install()
+            self.graph_changed()
+        elif not on and not self.instr is None:
+            self.instr.remove()
+            self.instr = None
+            self.graph_changed()
+
+    def profile(self, interval = 0.001):
+        """Sample every 'interval' seconds which edge of the graph each thread is in, the
+        samples of an edge are its 'samples' in snapshot().  0 stops the sampling.
+        """
+        if interval > 0:
+            self.instrument(True)
+        if not self.instr is None:
+            self.instr.profile(interval)
+
+    def snapshot(self):
+        """Return the statistics as a dict: 'nodes' maps the name of each Node to its
+        counters (see node_info()), with instrument() also 'calls', 'bytes' (in),
+        'bytes_out', 'ms' (time in recv() including the receivers), 'self_ms', 'p50_us',
+        'p99_us' and 'proc'.  'edges' maps "src -> dst" to the counters of the edge.
+        """
+        ret = {'time': time.time(), 'nodes': dict(), 'edges': dict()}
+        if self.instr is None:
+            for nd in list(self.nodes):
+                ret['nodes'][self.node_name(nd)] = self.node_info(nd)
+        else:
+            ret['elapsed'] = time.monotonic() - self.instr.t0
+            ret['nodes'], ret['edges'] = self.instr.snapshot()
+        return ret
+
+    def dumpStats(self, out, sec = 10.0):
+        """Every 'sec' seconds write snapshot() as a line of JSON to the file 'out' or call
+        out(snapshot) if it is a function.
+        """
+        import json
+        def dump():
+            snap = self.snapshot()
+            if callable(out):
+                out(snap)
+            else:
+                with open(out, 'a') as f:
+                    f.write(json.dumps(snap) + '\n')
+            self.call_later(sec, dump)
+        self.call_later(sec, dump)
+
+    def register_close(self, ob):
+        """ob.close() will be called when the app ends, in reverse order of registration.
+        """
+        self.closers.append(ob)
+
+    def register_proc(self, ob, thread = False):
+        """Have ob.proc() called by the shared ProcHandler or, with thread = True, by one
+        of its own (or of the pool, see setThreads()), so a slow line does not hold up
+        the others.
+        """
+        self.proc.append(ob)
+        if thread:
+            self.handler().add(ob)
+        else:
+            self.thr.add(ob)
+
+    def setThreads(self, count):
+        """Objects registered with thread = True share 'count' ProcHandlers,
+        0 (the default) gives each of them one of its own.
+        """
+        self.pool = count
+
+    def handler(self):
+        if self.pool > 0 and len(self.handlers) >= self.pool:
+            return min(self.handlers, key = lambda h: len(h.new) + len(h.ev) + len(h.polled))
+        h = ProcHandler(self)
+        self.handlers.append(h)
+        if self.started:
+            h.start()
+        return h
+
+    def start_threads(self):
+        """Called when the main loop starts, start the ProcHandlers.
+        """
+        self.started = True
+        for h in [self.thr] + self.handlers:
+            if isinstance(h, ProcHandler) and not h.is_alive():
+                h.start()
+
+    def shutdown(self):
+        """Stop the ProcHandlers and close the registered objects.
+        """
+        if not self.instr is None:
+            self.instr.profile(0)
+        for h in [self.thr] + self.handlers:
+            h.halt()
+        for h in [self.thr] + self.handlers:
+            if h.is_alive():
+                h.join()
+        # the last registered first, e.g. a NodeQueue before the Node it feeds
+        for ob in reversed(self.closers):
+            ob.close()
+        self.closers = []
+
+    # Node returning methods
+    def nodeSelect(self, uid = '', fusable = True):
+        ret = NodeSelect(self, uid, fusable)
+        return ret
+
+    def nodeHex(self, uid = '', bpl = 0, offset = False):
+        ret = NodeHex(self, uid, bpl, offset)
+        return ret
+
+    def nodeXferOut(self, uid = ''):
+        ret = NodeXferOut(self, uid)
+        return ret
+
+    def nodeXferIn(self, uid = ''):
+        ret = NodeXferIn(self, uid)
+        return ret
+
+    def nodeXferLink(self, uid = '', window = 32, timeout = 1.0, size = 1024, retries = 20):
+        ret = NodeXferLink(self, uid, window, timeout, size, retries)
+        return ret
+
+    def nodeFunc(self, fn, uid = ''):
+        ret = NodeFunc(self, fn, uid)
+        return ret
+
+    def nodeLinebuffer(self, uid = '', term = b'\r', max_line = 0, timeout = 0):
+        ret = NodeLinebuffer(self, uid, term, max_line, timeout)
+        return ret
+
+    def nodeSeqCheck(self, lobs, uid = '', strict = False):
+        ret = NodeSeqCheck(self, lobs, uid, strict)
+        return ret
+
+    def nodeQueue(self, node, uid = '', capacity = 1 << 20, policy = 'block'):
+        ret = NodeQueue(self, node, uid, capacity, policy)
+        return ret
+
+    def nodeProcess(self, factory, uid = '', size = 1 << 20, latency = 0.01, max_batch = 65536, method = None):
+        import mtpool
+        ret = mtpool.NodeProcess(self, factory, uid, size, latency, max_batch, method)
+        self.register_proc(ret)
+        return ret
+
+    def nodeLogfile(self, fname, uid = '', fmt = 'raw', max_size = 0, max_age = 0, backups = 5,
+            compress = None, level = 6, max_pending = 1 << 24):
+        ret = NodeLogfile(self, fname, uid, fmt, max_size, max_age, backups, compress, level, max_pending)
+        return ret
+
+    def nodeKeyboard(self, uid = ''):
+        ret = NodeKeyboard(self, uid)
+        return ret
+
+    def nodeSerial(self, ser, uid = '', latency = 0.01, max_batch = 65536, max_pending = 1 << 20,
+                   thread = False, pool = 16, chunk = 4096):
+        ret = NodeSerial(self, ser, uid, latency, max_batch, max_pending, pool, chunk)
+        self.register_proc(ret, thread)
+        return ret
+
+    def nodeReplay(self, fname, uid = '', chunk = 4096, speed = 0, max_pending = 1 << 20, fmt = None):
+        ret = NodeReplay(self, fname, uid, chunk, speed, max_pending, fmt)
+        self.register_proc(ret)
+        return ret
+
+    def nodeText(self, col, uid = ''):
+        ret = NodeText(self, col, uid)
+        return ret
+
+    def nodeStdout(self, uid = '', out = None):
+        ret = NodeStdout(self, uid, out)
+        return ret
+
+
+class MTHeadless(MTCore):
+    """Run a graph of Nodes without GUI, e.g. on a server.
+    The text of the NodeText()s is written to 'out' (default: stdout), the colors are ignored.
+    MainLoop() runs until quit() is called.
+    """
+    def __init__(self, out = None):
+        MTCore.__init__(self)
+        self.out = sys.stdout.buffer if out is None else out
+        self.cv = threading.Condition()
+        self.calls = [] # heap of (time, number, function) for call_later()
+        self.cnt = itertools.count()
+        self.pending = False    # post() was called
+        self.running = False
+
+    def post(self):
+        with self.cv:
+            self.pending = True
+            self.cv.notify()
+
+    def render(self, col, ba):
+        self.out.write(ba)
+
+    def call_later(self, sec, fn):
+        with self.cv:
+            heapq.heappush(self.calls, (time.monotonic() + sec, next(self.cnt), fn))
+            self.cv.notify()
+
+    def quit(self):
+        with self.cv:
+            self.running = False
+            self.cv.notify()
+
+    def MainLoop(self):
+        self.running = True
+        self.start_threads()
+        while True:
+            with self.cv:
+                while self.running and not self.pending and \
+                        (len(self.calls) == 0 or self.calls[0][0] > time.monotonic()):
+                    tmo = None if len(self.calls) == 0 else self.calls[0][0] - time.monotonic()
+                    self.cv.wait(tmo)
+                if not self.running:
+                    break
+                pending = self.pending
+                self.pending = False
+                due = []
+                now = time.monotonic()
+                while len(self.calls) != 0 and self.calls[0][0] <= now:
+                    due.append(heapq.heappop(self.calls)[2])
+            if pending:
+                self.deliver()
+            for fn in due:
+                fn()
+            self.out.flush()
+        self.shutdown()
+        self.out.flush()
+
+
+if __name__ == '__main__':
+    # run a graph of Nodes without GUI: the given file must define init(app)
+    if len(sys.argv) != 2:
+        print("usage: %s <config.py>" % (sys.argv[0]))
+        sys.exit(1)
+    app = MTHeadless()
+    mod = load_mod(sys.argv[1])
+    mod.init(app)
+    try:
+        app.MainLoop()
+    except KeyboardInterrupt:
+        app.shutdown()
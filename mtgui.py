@@ -0,0 +1,265 @@
+#! /usr/bin/python3
+
+"""
+MultiTerm, the wx front end on top of mtcore.  Scripts use it through multiterm, which
+imports this module (and wx) only when a name of it is used first.
+"""
+
+import wx
+import wx.lib.newevent
+import time
+import threading
+
+from mtcore import *
+
+
+SerialEvent, EVT_SERIAL_EVENT = wx.lib.newevent.NewEvent()
+
+
+class MTTextCtrl(wx.VListBox):
+    """The text panel.  Only the visible lines of the Scrollback are drawn, so appending
+    text costs the same no matter how many lines are kept.
+    """
+    def __init__(self, par):
+        wx.VListBox.__init__(self, par)
+        self.par = par
+        self.tcol = wx.BLACK
+        self.sb = Scrollback()
+        self.font = wx.Font(12, wx.FONTFAMILY_TELETYPE, wx.FONTSTYLE_NORMAL, wx.FONTWEIGHT_NORMAL, False)
+        self.SetFont(self.font)
+        self.SetBackgroundColour(wx.WHITE)
+        dc = wx.ClientDC(self)
+        dc.SetFont(self.font)
+        self.lh = dc.GetCharHeight()
+        self.SetItemCount(len(self.sb))
+
+        self.Bind(wx.EVT_CHAR_HOOK, self.OnChar)
+        self.SetFocus()
+
+#        self.append_text(wx.RED, b"Hi There")
+
+    def OnMeasureItem(self, n):
+        return self.lh
+
+    def OnDrawItem(self, dc, rect, n):
+        dc.SetFont(self.font)
+        x = rect.x + 2
+        for col, ba in self.sb.line(n):
+            txt = ba.decode('utf-8', 'ignore').expandtabs()
+            dc.SetTextForeground(col)
+            dc.DrawText(txt, x, rect.y)
+            x += dc.GetTextExtent(txt)[0]
+
+    def OnChar(self, evt):
+        m = evt.GetModifiers()
+        k = evt.GetUnicodeKey()
+        sdown = evt.ShiftDown()
+        cdown = evt.ControlDown()
+        adown = evt.AltDown()
+        if k == 0:
+            k = evt.GetKeyCode()
+        if k == 0 or k > 255:
+            return
+
+        c = str(chr(k))
+        if sdown:
+            c = c.upper()
+        else:
+            c = c.lower()
+
+        ba = bytearray()
+        ba.append(ord(c))
+        if self.par.par.kl:
+            self.par.par.kl.recv(ba, 'wx.Key')
+
+    def append_text(self, tcol, txt):
+        self.append_segments(((tcol, txt),))
+
+    def append_segments(self, lst):
+        """Append a list of (color, bytes) and redraw the panel once.
+        """
+        self.Freeze()
+        try:
+            self.add_segments(lst)
+        finally:
+            self.Thaw()
+
+    def add_segments(self, lst):
+        n = self.GetItemCount()
+        bottom = n <= 1 or self.IsRowVisible(n - 1)
+        first = n - 1   # the first line that changed
+        trimmed = 0     # lines dropped at the top, all rows then show other lines
+        for tcol, txt in lst:
+            self.tcol = tcol
+            trimmed += self.sb.append(tcol, txt)
+        first -= trimmed
+        n = len(self.sb)
+        if n != self.GetItemCount():
+            self.SetItemCount(n)
+        if trimmed > 0 or first < 0:
+            self.Refresh()
+        else:
+            self.RefreshRows(first, n - 1)
+        if bottom:
+            self.ScrollToRow(n - 1)
+
+
+class MTFrame(wx.Frame):
+    def __init__(self, par):
+        wx.Frame.__init__(self, None)
+        self.par = par
+
+        self.vbox = wx.BoxSizer(wx.VERTICAL)
+
+        self.panel = wx.Panel(self)
+#        self.panel.SetBackgroundColour(wx.RED)
+        self.vbox.Add(self.panel, proportion = 0, flag = wx.EXPAND | wx.ALL, border = 0)
+
+        self.tc = MTTextCtrl(self)
+        self.vbox.Add(self.tc, proportion = 1, flag = wx.EXPAND | wx.ALL, border = 0)
+
+        self.hbox = wx.BoxSizer(wx.HORIZONTAL)
+        self.panel.SetSizer(self.hbox)
+
+        self.SetSizer(self.vbox)
+        self.Show(True)
+
+        self.Bind(wx.EVT_CLOSE, self.OnClose)
+
+        self.par.start_threads()
+
+    def OnClose(self, evt):
+        if not getattr(self.par, 'stats_timer', None) is None:
+            self.par.stats_timer.Stop()
+        self.par.shutdown()
+        self.tc.sb.close()
+        self.Destroy()
+
+    def append_text(self, tcol, txt):
+        self.tc.append_text(tcol, txt)
+
+
+class MultiTerm(wx.App, MTCore):
+    """The wx front end: a frame with the text panel, the keyboard input and the data
+    received by the ProcHandler delivered via SerialEvents.
+    """
+    def __init__(self, *args, **kwds):
+        wx.App.__init__(self, *args, **kwds)
+        MTCore.__init__(self)
+#        self.s = s
+        self.f = MTFrame(self)
+        self.f.Show()
+#        self.st = load_mod("settings.py")
+#        print("fontsize", self.st.fontsize)
+#        self.st.init(self)
+
+        self.rq = []    # [color, bytearray] waiting to be shown in the text panel
+        self.rn = 0     # number of bytes in rq
+        self.rlock = threading.Lock()
+        self.rsched = False # a flush of rq is scheduled
+        self.rlast = 0  # time of the last flush
+        self.render_hz = 30
+        self.render_max = 1 << 16
+
+        self.Bind(EVT_SERIAL_EVENT, self.OnSerial)
+
+    def setRender(self, hz, max_batch = 1 << 16):
+        """Show queued text at most hz times per second, or as soon as max_batch bytes
+        are waiting.
+        """
+        self.render_hz = hz
+        self.render_max = max_batch
+
+    def render(self, col, ba):
+        """Queue text for the text panel, adjacent text of the same color is merged.
+        May be called from any thread.
+        """
+        with self.rlock:
+            if len(self.rq) != 0 and self.rq[-1][0] == col:
+                self.rq[-1][1] += ba
+            else:
+                self.rq.append([col, bytearray(ba)])
+            self.rn += len(ba)
+            full = self.rn >= self.render_max
+            sched = not self.rsched
+            self.rsched = True
+        if full:
+            wx.CallAfter(self.flush_text)
+        elif sched:
+            wx.CallAfter(self.schedule_text)
+
+    def schedule_text(self):
+        dt = self.rlast + 1.0 / self.render_hz - time.monotonic()
+        if dt <= 0:
+            self.flush_text()
+        else:
+            wx.CallLater(int(dt * 1000) + 1, self.flush_text)
+
+    def flush_text(self):
+        with self.rlock:
+            lst = self.rq
+            self.rq = []
+            self.rn = 0
+            self.rsched = False
+        self.rlast = time.monotonic()
+        if len(lst) != 0:
+            self.f.tc.append_segments(lst)
+
+    def post(self):
+        wx.PostEvent(self, SerialEvent())
+
+    def OnSerial(self, evt):
+        self.deliver()
+
+    def call_later(self, sec, fn):
+        """Call fn() in the main loop after sec seconds, may be called from any thread.
+        """
+        wx.CallAfter(wx.CallLater, int(sec * 1000) + 1, fn)
+
+    def quit(self):
+        self.f.OnClose(None)
+
+    def addButton(self, txt, cback):
+        btn = wx.Button(self.f.panel, -1, txt)
+        self.f.hbox.Add(btn)
+        self.f.hbox.Layout()
+        self.f.Fit()
+        btn.Bind(wx.EVT_BUTTON, cback)
+
+    def addChoice(self, lst, cback):
+        chc = wx.Choice(self.f.panel, -1, choices = lst)
+        self.f.hbox.Add(chc)
+        self.f.hbox.Layout()
+        self.f.Fit()
+        chc.Bind(wx.EVT_CHOICE, cback)
+
+    def setScrollback(self, max_lines, max_bytes = 0, spill = None):
+        """Keep at most max_lines lines / max_bytes bytes in the text panel (0: no limit),
+        older lines are appended to the file spill if given.
+        """
+        self.f.tc.sb.configure(max_lines, max_bytes, spill)
+        self.f.tc.SetItemCount(len(self.f.tc.sb))
+        self.f.tc.Refresh()
+
+    def addStatusBar(self):
+        sbar = self.f.CreateStatusBar()
+        return sbar
+
+    def showStats(self, sec = 1.0):
+        """Show the receive rate of each serial line, the depths of the queues and what was
+        dropped in the status bar, updated every sec seconds (see MTCore.snapshot()).
+        """
+        self.sbar = self.f.GetStatusBar()
+        if self.sbar is None:
+            self.sbar = self.addStatusBar()
+        self.stats_prev = None
+        self.stats_timer = wx.Timer(self)
+        self.Bind(wx.EVT_TIMER, self.OnStats, self.stats_timer)
+        self.stats_timer.Start(int(sec * 1000))
+
+    def OnStats(self, evt):
+        snap = self.snapshot()
+        self.sbar.SetStatusText(stats_text(snap, self.stats_prev))
+        self.stats_prev = snap
+
+
@@ -0,0 +1,313 @@
+#! /usr/bin/python3
+
+"""
+Run CPU heavy parts of a graph of Nodes in worker processes.  The data crosses the
+process boundary through ring buffers in shared memory, calls back into the main
+process are marshalled by name.
+"""
+
+import time
+import struct
+import pickle
+import collections
+import multiprocessing
+from multiprocessing import shared_memory
+
+from mtcore import *
+
+
+RINGHDR = 128   # head at 0, tail at 64, each on a cache line of its own
+POS = struct.Struct('<Q')
+RECHDR = struct.Struct('<IB')   # length of the payload, kind of the record
+
+REC_DATA = 0    # bytes for the receivers
+REC_CALL = 1    # pickled (name, args) for a function registered with register_call()
+REC_QUIT = 2    # end the worker
+
+
+class ShmRing(object):
+    """A single producer / single consumer ring buffer of records in shared memory.
+
+    Head and tail count the bytes written / read since the start, so the ring is empty
+    when they are equal.  The producer rings the doorbell (a multiprocessing Connection,
+    the consumer can select() on its fileno()) whenever a record makes the empty ring
+    non-empty.  That test and the last test of the consumer before it waits for the
+    doorbell are done under 'lock' (a multiprocessing Lock shared by both ends), so one
+    of them always sees the other's update and no wakeup is lost.  The ring is created
+    when no name is given, else attached.
+    """
+    def __init__(self, size = 1 << 20, name = None, bell = None, lock = None):
+        if name is None:
+            self.shm = shared_memory.SharedMemory(create = True, size = RINGHDR + size)
+            self.size = size
+            self.shm.buf[:RINGHDR] = bytes(RINGHDR)
+        else:
+            self.shm = shared_memory.SharedMemory(name = name)
+            self.size = size
+        self.name = self.shm.name
+        self.buf = self.shm.buf
+        self.bell = bell
+        self.lock = multiprocessing.Lock() if lock is None else lock
+
+    def put(self, pos, ba):
+        i = pos % self.size
+        n = len(ba)
+        first = min(n, self.size - i)
+        self.buf[RINGHDR+i:RINGHDR+i+first] = ba[:first]
+        if first < n:
+            self.buf[RINGHDR:RINGHDR+n-first] = ba[first:]
+
+    def get(self, pos, n):
+        i = pos % self.size
+        first = min(n, self.size - i)
+        if first == n:
+            return bytes(self.buf[RINGHDR+i:RINGHDR+i+n])
+        return bytes(self.buf[RINGHDR+i:RINGHDR+self.size]) + bytes(self.buf[RINGHDR:RINGHDR+n-first])
+
+    def write(self, kind, ba):
+        """Append a record, return False if there is not enough room for it.
+        """
+        n = RECHDR.size + len(ba)
+        head = POS.unpack_from(self.buf, 0)[0]
+        tail = POS.unpack_from(self.buf, 64)[0]
+        if n > self.size - (head - tail):
+            return False
+        self.put(head, RECHDR.pack(len(ba), kind))
+        self.put(head + RECHDR.size, ba)
+        with self.lock:
+            POS.pack_into(self.buf, 0, head + n)
+            empty = POS.unpack_from(self.buf, 64)[0] == head
+        if empty:
+            self.bell.send_bytes(b'\0')
+        return True
+
+    def next_size(self):
+        """Return the length of the data of the next record or None if the ring is empty.
+        """
+        head = POS.unpack_from(self.buf, 0)[0]
+        tail = POS.unpack_from(self.buf, 64)[0]
+        if head == tail:
+            return None
+        return RECHDR.unpack(self.get(tail, RECHDR.size))[0]
+
+    def read(self):
+        """Return the next record as (kind, data) or None if the ring is empty.
+        """
+        head = POS.unpack_from(self.buf, 0)[0]
+        tail = POS.unpack_from(self.buf, 64)[0]
+        if head == tail:
+            return None
+        n, kind = RECHDR.unpack(self.get(tail, RECHDR.size))
+        ba = self.get(tail + RECHDR.size, n)
+        POS.pack_into(self.buf, 64, tail + RECHDR.size + n)
+        return kind, ba
+
+    def sleep(self):
+        """Called by the consumer when the ring is empty, before it waits for the doorbell.
+        Returns True if a record arrived in the meantime.
+        """
+        with self.lock:
+            return POS.unpack_from(self.buf, 0)[0] != POS.unpack_from(self.buf, 64)[0]
+
+    def clear_bell(self):
+        while self.bell.poll(0):
+            self.bell.recv_bytes()
+
+    def close(self, unlink = False):
+        self.buf = None
+        self.shm.close()
+        if unlink:
+            self.shm.unlink()
+
+
+class NodeRing(NodeSource):
+    """The end of a pair of ShmRings: data received by this Node is written into 'tx', the
+    records read from 'rx' are delivered to the receivers in the main loop, like the data
+    of a NodeSerial.  Calls (REC_CALL) are done in the main loop after the data read with
+    them, with the functions registered by register_call().
+    Records are only read from 'rx' while less than 'max_pending' bytes wait for delivery,
+    the rest stays in the ring, so a writer on the other side waits for room instead of
+    the data being dropped.
+    What does not fit into 'tx' is queued and the app is throttled (MTCore.throttle()),
+    so no more data is delivered until the queue was written; the times this happened
+    are counted in 'blocked'.  If peer() returns False, the data is dropped and counted in
+    'dropped'.
+    """
+    def __init__(self, app, rx, tx, uid = '', latency = 0.01, max_batch = 65536, max_pending = 1 << 20):
+        NodeSource.__init__(self, app, uid, latency, max_batch, max_pending)
+        self.rx = rx
+        self.tx = tx
+        self.chunk = max(tx.size // 4, 1)
+        self.calls = collections.deque()
+        self.funcs = dict()
+        self.blocked = 0
+        self.wq = collections.deque()   # (kind, data) waiting for room in 'tx'
+        self.wlock = threading.Lock()
+        self.thr = None         # the ProcHandler that reads 'rx'
+        self.stalled = 0        # the size of the record left in 'rx', see read_pending()
+
+    def peer(self):
+        parent = multiprocessing.parent_process()
+        return parent is None or parent.is_alive()
+
+    def register_call(self, name, fn):
+        self.funcs[name] = fn
+
+    def attach(self, thr):
+        self.thr = thr
+
+    def fileno(self):
+        return self.rx.bell.fileno()
+
+    def read_pending(self):
+        return self.stalled != 0 and (self.rn == 0 or self.rn + self.stalled <= self.max_pending)
+
+    def send(self, kind, ba):
+        with self.wlock:
+            if len(self.wq) == 0 and self.tx.write(kind, ba):
+                return True
+            if not self.peer():
+                self.dropped += len(ba)
+                return False
+            self.wq.append((kind, bytes(ba)))
+            if len(self.wq) == 1:
+                self.blocked += 1
+                self.app.throttle(self, True)
+                self.app.call_later(0.001, self.flush)
+        return True
+
+    def flush(self):
+        """Write the queued records, called in the main loop while 'tx' is full.
+        """
+        with self.wlock:
+            while len(self.wq) != 0 and self.tx.write(*self.wq[0]):
+                self.wq.popleft()
+            if len(self.wq) != 0 and not self.peer():
+                self.dropped += sum(len(ba) for kind, ba in self.wq)
+                self.wq.clear()
+            if len(self.wq) != 0:
+                self.app.call_later(0.001, self.flush)
+                return
+        self.app.throttle(self, False)
+
+    def recv(self, ba, caller = ''):
+        for i in range(0, len(ba), self.chunk):
+            self.send(REC_DATA, ba[i:i+self.chunk])
+
+    def call(self, name, *args):
+        self.send(REC_CALL, pickle.dumps((name, args)))
+
+    def proc(self):
+        self.rx.clear_bell()
+        self.stalled = 0
+        while True:
+            n = self.rx.next_size()
+            if not n is None and self.rn != 0 and self.rn + n > self.max_pending:
+                # push() would drop it: leave it in the ring, the doorbell only rings when
+                # the ring was empty, read_pending() tells when to go on
+                self.stalled = max(n, 1)
+                break
+            rec = self.rx.read()
+            if rec is None:
+                if self.rx.sleep():
+                    continue
+                break
+            kind, ba = rec
+            if kind == REC_DATA:
+                self.push(ba)
+            elif kind == REC_CALL:
+                self.calls.append(pickle.loads(ba))
+            elif kind == REC_QUIT:
+                self.app.quit()
+
+    def due(self, now):
+        if len(self.calls) != 0:
+            return 0
+        return NodeSource.due(self, now)
+
+    def drain(self):
+        NodeSource.drain(self)
+        while len(self.calls) != 0:
+            name, args = self.calls.popleft()
+            self.funcs[name](*args)
+        if self.stalled != 0 and not self.thr is None:
+            self.thr.wakeup()
+
+
+class WorkerApp(MTHeadless):
+    """The app of a worker process started by NodeProcess.  The text of NodeText()s is
+    shown by the app of the main process, remote(name, *args) calls the function
+    registered with NodeProcess.register_call(name, fn) in the main process.
+    """
+    def __init__(self):
+        MTHeadless.__init__(self)
+        self.ring = None
+
+    def remote(self, name, *args):
+        self.ring.call(name, *args)
+
+    def render(self, col, ba):
+        self.remote('render', col, bytes(ba))
+
+
+def worker(factory, rx, tx, size, bell_rx, bell_tx, lock_rx, lock_tx, latency, max_batch):
+    app = WorkerApp()
+    ring = NodeRing(app, ShmRing(size, rx, bell_rx, lock_rx), ShmRing(size, tx, bell_tx, lock_tx), 'worker',
+                    latency, max_batch)
+    app.ring = ring
+    ring.append_receiver(factory(app, ring))
+    app.register_proc(ring)
+    try:
+        app.MainLoop()
+    finally:
+        ring.rx.close()
+        ring.tx.close()
+
+
+class NodeProcess(NodeRing):
+    """Run a part of the graph of Nodes in a worker process, e.g. a NodeSeqCheck or a
+    NodeXferIn on a busy line, so it does not slow down the other lines and the GUI.
+
+    factory(app, out) is called in the worker with the worker's app (a WorkerApp): it
+    creates the Nodes, connects the ones whose output shall come back to 'out' and returns
+    the Node that gets the data received by this Node.  Their output is delivered to the
+    receivers of this Node in the main loop.  In the worker, app.remote(name, *args) calls
+    the function registered here with register_call(name, fn).
+    With the start methods 'spawn' and 'forkserver' ('method', default: the one of
+    multiprocessing) the factory must be a function at module level and the main script
+    must be guarded by "if __name__ == '__main__':".
+    """
+    def __init__(self, app, factory, uid = '', size = 1 << 20, latency = 0.01, max_batch = 65536,
+                 method = None):
+        ctx = multiprocessing.get_context(method)
+        rx_r, rx_w = ctx.Pipe(duplex = False)
+        tx_r, tx_w = ctx.Pipe(duplex = False)
+        NodeRing.__init__(self, app, ShmRing(size, None, rx_r, ctx.Lock()), ShmRing(size, None, tx_w, ctx.Lock()),
+                          uid, latency, max_batch)
+        self.register_call('render', app.render)
+        self.p = ctx.Process(target = worker, daemon = True,
+                             args = (factory, self.tx.name, self.rx.name, size, tx_r, rx_w,
+                                     self.tx.lock, self.rx.lock, latency, max_batch))
+        self.p.start()
+        tx_r.close()
+        rx_w.close()
+        app.register_close(self)
+
+    def peer(self):
+        return self.p.is_alive()
+
+    def close(self, timeout = 2.0):
+        """End the worker and free the shared memory.
+        """
+        if self.p.is_alive():
+            self.send(REC_QUIT, b'')
+            end = time.monotonic() + timeout
+            while len(self.wq) != 0 and time.monotonic() < end:
+                time.sleep(0.001)   # the main loop has ended, write the queue here
+                self.flush()
+            self.p.join(timeout)
+            if self.p.is_alive():
+                self.p.terminate()
+                self.p.join()
+        self.rx.close(True)
+        self.tx.close(True)
@@ -0,0 +1,206 @@
+#! /usr/bin/python3
+
+"""
+A loopback test of NodeXferLink: two apps without GUI, each with a NodeSerial on one end
+of a socket pair, send data to each other over a NodeXferLink.  The packets on the way
+are lost, reordered or corrupted at random (see the options), the data must arrive
+complete and in order and the counters of the links must show that the faults occurred.
+
+    python3 xferloop.py
+    python3 xferloop.py --loss 0.2 --size 200000
+
+The exit status is 1 if a case failed.
+"""
+
+import sys
+import time
+import random
+import socket
+import argparse
+import threading
+
+import mtcore as mt
+
+
+class SockLine(object):
+    """One end of a socket pair with the part of a serial line that NodeSerial uses.
+    """
+    def __init__(self, sock):
+        self.sock = sock
+        self.sock.setblocking(False)
+
+    def fileno(self):
+        return self.sock.fileno()
+
+    def write(self, ba):
+        try:
+            return self.sock.send(ba)
+        except BlockingIOError:
+            return 0
+
+    def close(self):
+        self.sock.close()
+
+
+class NodeFaults(mt.Node):
+    """Passes the XFER packets of its input on, some of them are lost, held back until the
+    next one was passed on (reordered) or get a byte changed (the CRC-32 of the link fails).
+    """
+    def __init__(self, app, rnd, loss = 0.0, reorder = 0.0, corrupt = 0.0, uid = ''):
+        mt.Node.__init__(self, app, uid)
+        self.rnd = rnd
+        self.loss = loss
+        self.reorder = reorder
+        self.corrupt = corrupt
+        self.held = None
+        self.stats = dict.fromkeys(('passed', 'lost', 'reordered', 'corrupted'), 0)
+        self.dec = mt.NodeXferIn(app)
+        self.dec.add_packet_receiver(mt.NodeFunc(app, self.packet))
+
+    def recv(self, ba, caller):
+        self.dec.recv(ba, caller)
+
+    def packet(self, p, caller):
+        p = bytearray(p)
+        r = self.rnd.random()
+        if r < self.loss:
+            self.stats['lost'] += 1
+            return
+        r -= self.loss
+        if r < self.corrupt:
+            self.stats['corrupted'] += 1
+            p[self.rnd.randrange(len(p))] ^= 1 << self.rnd.randrange(8)
+        elif r - self.corrupt < self.reorder and self.held is None:
+            self.stats['reordered'] += 1
+            self.held = p
+            return
+        self.stats['passed'] += 1
+        out = mt.xfer_frame(p)
+        if not self.held is None:
+            mt.xfer_frame(self.held, out)
+            self.held = None
+        self.emit(out)
+
+
+class Side(object):
+    """One app with its serial line, link and the faults of its sending direction.
+    """
+    def __init__(self, name, sock, rnd, args):
+        self.app = mt.MTHeadless(out = open('/dev/null', 'wb'))
+        self.app.on_error = self.on_error
+        self.ser = self.app.nodeSerial(SockLine(sock), name + '-line', latency = 0.001)
+        self.link = self.app.nodeXferLink(name, window = args.window, timeout = args.timeout,
+                                          retries = args.retries)
+        self.faults = NodeFaults(self.app, rnd, args.loss, args.reorder, args.corrupt, name + '-faults')
+        self.link.append_receiver(self.faults)
+        self.faults.append_receiver(self.ser)
+        self.ser.append_receiver(self.link.wire)
+        self.got = bytearray()
+        self.link.add_packet_receiver(self.app.nodeFunc(self.packet))
+        self.link.on_error = self.failed
+        self.errors = []
+        self.thread = None
+
+    def packet(self, ba, caller):
+        self.got += ba
+
+    def failed(self, link):
+        self.errors.append(('link', threading.current_thread() is self.thread))
+
+    def on_error(self, ob, e):
+        self.errors.append((self.app.node_name(ob), e))
+
+    def start(self):
+        self.thread = threading.Thread(target = self.app.MainLoop, daemon = True)
+        self.thread.start()
+
+    def send(self, data):
+        self.app.call_later(0, lambda: self.link.recv(data, ''))
+
+    def stop(self):
+        self.app.quit()
+        self.thread.join()
+
+
+def run(name, args, loss = 0.0, reorder = 0.0, corrupt = 0.0, give_up = False):
+    """Send args.size bytes each way, return a list of what went wrong.
+    """
+    rnd = random.Random(args.seed)
+    args = argparse.Namespace(**vars(args))
+    args.loss, args.reorder, args.corrupt = loss, reorder, corrupt
+    s0, s1 = socket.socketpair()
+    a = Side('a', s0, rnd, args)
+    b = Side('b', s1, rnd, args)
+    da = bytes(rnd.getrandbits(8) for i in range(args.size))
+    db = bytes(rnd.getrandbits(8) for i in range(args.size))
+    a.start()
+    b.start()
+    a.send(da)
+    b.send(db)
+    t0 = time.monotonic()
+    limit = t0 + args.limit
+    while time.monotonic() < limit:
+        if give_up and len(a.errors) != 0 and len(b.errors) != 0:
+            break
+        if not give_up and a.link.done() and b.link.done() and \
+                len(a.got) == len(db) and len(b.got) == len(da):
+            break
+        time.sleep(0.01)
+    dt = time.monotonic() - t0
+    a.stop()
+    b.stop()
+    errs = []
+    if give_up:
+        for side in (a, b):
+            if side.errors != [('link', True)]:
+                errs.append("%s: on_error was not called once in the main loop: %r" % (side.link.uid, side.errors))
+    else:
+        if b.got != da or a.got != db:
+            errs.append("data differ: %i of %i / %i of %i bytes" % (len(b.got), len(da), len(a.got), len(db)))
+        for side in (a, b):
+            if len(side.errors) != 0:
+                errs.append("%s: errors %r" % (side.link.uid, side.errors))
+        st = dict((k, a.link.stats[k] + b.link.stats[k]) for k in a.link.stats)
+        ft = dict((k, a.faults.stats[k] + b.faults.stats[k]) for k in a.faults.stats)
+        if ft['lost'] + ft['corrupted'] != 0 and st['resent'] == 0:
+            errs.append("packets were lost, none was sent again")
+        if ft['corrupted'] != 0 and st['crcerr'] == 0:
+            errs.append("packets were corrupted, no CRC error was counted")
+        if ft['reordered'] != 0 and st['nacked'] == 0:
+            errs.append("packets were reordered, no NACK was counted")
+        print("%-10s %6.2f s  link %s  faults %s" % (name, dt, st, ft))
+    return errs
+
+
+def main():
+    p = argparse.ArgumentParser(description = "Loopback test of NodeXferLink with lost, reordered and corrupted packets")
+    p.add_argument('--seed', type = int, default = 1)
+    p.add_argument('--size', type = int, default = 100000, help = "bytes sent each way")
+    p.add_argument('--loss', type = float, default = 0.05)
+    p.add_argument('--reorder', type = float, default = 0.05)
+    p.add_argument('--corrupt', type = float, default = 0.05)
+    p.add_argument('--window', type = int, default = 32)
+    p.add_argument('--timeout', type = float, default = 0.05, help = "seconds until a packet is sent again")
+    p.add_argument('--retries', type = int, default = 20)
+    p.add_argument('--limit', type = float, default = 60, help = "seconds a case may take")
+    args = p.parse_args()
+    cases = [
+        ('clean', dict()),
+        ('loss', dict(loss = args.loss)),
+        ('reorder', dict(reorder = args.reorder)),
+        ('corrupt', dict(corrupt = args.corrupt)),
+        ('all', dict(loss = args.loss, reorder = args.reorder, corrupt = args.corrupt)),
+        ('give-up', dict(loss = 1.0, give_up = True)),
+    ]
+    failed = 0
+    for name, kw in cases:
+        errs = run(name, args, **kw)
+        for e in errs:
+            print("%s: %s" % (name, e))
+        failed += len(errs) != 0
+    print("%i of %i cases failed" % (failed, len(cases)))
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()